@@ -0,0 +1,147 @@
+import subprocess
+import numpy as np
+
+
+class PCMStreamReader:
+    def __init__(self, source, samplerate=44100, channels=2, start_seconds=0.0, headers=None):
+        """
+        Decodes a source with ffmpeg and reads it as raw 16-bit PCM from a pipe,
+        so only the part that is currently needed is ever held in memory.
+
+        Args:
+            source (str): Path or URL of the audio to decode.
+            samplerate (int): Sample rate ffmpeg resamples to.
+            channels (int): Number of channels ffmpeg mixes to.
+            start_seconds (float): Position in the source decoding starts at.
+            headers (dict): HTTP headers sent along when the source is a URL.
+        """
+        self.source = source
+        self.samplerate = samplerate
+        self.channels = channels
+        self.start_seconds = start_seconds
+        self.headers = headers
+        self.process = None
+        self.pads = {}  # Window index -> (frames of overlap before, frames of overlap after)
+
+    def open(self):
+        headers = []
+        if self.headers:
+            headers = ['-headers', "".join(f"{name}: {value}\r\n" for name, value in self.headers.items())]
+        self.process = subprocess.Popen(
+            [
+                'ffmpeg',
+                '-nostdin',
+                '-loglevel', 'error',
+                '-ss', f'{self.start_seconds:.6f}',  # Seek before decoding
+                *headers,                          # HTTP headers the stream URL expects
+                '-i', self.source,                 # Input file or URL
+                '-f', 's16le',                     # Output format: 16-bit PCM
+                '-acodec', 'pcm_s16le',            # Audio codec
+                '-ar', str(self.samplerate),       # Sample rate
+                '-ac', str(self.channels),         # Number of channels
+                'pipe:1'                           # Output to stdout
+            ],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL
+        )
+        return self
+
+    def close(self):
+        if self.process is not None:
+            self.process.stdout.close()
+            self.process.terminate()
+            self.process.wait()
+            self.process = None
+
+    def wait(self):
+        """Waits for ffmpeg to exit after the end of the stream and raises if decoding failed."""
+        if self.process.wait() != 0:
+            raise RuntimeError(f"ffmpeg failed to decode '{self.source}'")
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    def read(self, num_frames):
+        """
+        Reads up to `num_frames` frames, fewer only at the end of the stream.
+
+        Returns:
+            np.ndarray: float32 array of shape (frames, channels) in [-1, 1].
+        """
+        frame_bytes = 2 * self.channels
+        data = self.process.stdout.read(max(num_frames, 0) * frame_bytes)
+        data = data[:len(data) - len(data) % frame_bytes]  # Drop a trailing partial frame
+        samples = np.frombuffer(data, dtype=np.int16).reshape(-1, self.channels)
+        return samples.astype(np.float32) / 32768.0
+
+    def windows(self, hop_ms, overlap_ms):
+        """
+        Lazily yields overlapping windows over the stream. Window `i` covers its
+        own hop plus `overlap_ms` on each side, clamped to the start and end of
+        the audio. How much padding each window actually got is recorded in
+        `self.pads` so the overlap can be trimmed exactly.
+
+        Args:
+            hop_ms (int or callable): Length of each window's own audio in
+                milliseconds, or a function called once per window to get it.
+            overlap_ms (int): Extra audio on each side of a window in milliseconds.
+
+        Yields:
+            tuple: (window index, float32 array of shape (frames, channels))
+        """
+        next_hop_ms = hop_ms if callable(hop_ms) else (lambda: hop_ms)
+        pad = overlap_ms * self.samplerate // 1000
+        self.pads = {}
+
+        i = 0
+        hop_start = 0  # First frame that belongs to window i itself
+        hop = next_hop_ms() * self.samplerate // 1000
+        window_start = 0
+        window = self.read(hop + pad)
+        # Only yield windows that reach past the previous hop, otherwise they hold nothing new
+        while len(window) > 0 and window_start + len(window) > hop_start:
+            window_end = window_start + len(window)
+            self.pads[i] = (hop_start - window_start, max(window_end - (hop_start + hop), 0))
+            yield i, window
+            i += 1
+            hop_start += hop
+            hop = next_hop_ms() * self.samplerate // 1000
+            next_start = hop_start - pad
+            tail = window[next_start - window_start:]
+            window = np.concatenate([tail, self.read(hop_start + hop + pad - window_end)])
+            window_start = next_start
+        self.wait()
+
+
+class ArrayStreamReader(PCMStreamReader):
+    def __init__(self, audio, samplerate=44100, start_seconds=0.0):
+        """
+        Serves already decoded audio through the PCMStreamReader interface, for
+        benchmarks and tools that work on generated audio without ffmpeg.
+
+        Args:
+            audio (np.ndarray): float32 array of shape (samples, channels).
+            samplerate (int): Sample rate of `audio`.
+            start_seconds (float): Position in `audio` reading starts at.
+        """
+        super().__init__(None, samplerate, audio.shape[1], start_seconds)
+        self.audio = audio
+        self.position = 0
+
+    def open(self):
+        self.position = round(self.start_seconds * self.samplerate)
+        return self
+
+    def close(self):
+        pass
+
+    def wait(self):
+        pass
+
+    def read(self, num_frames):
+        frames = self.audio[self.position:self.position + max(num_frames, 0)]
+        self.position += len(frames)
+        return frames
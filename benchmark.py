@@ -0,0 +1,523 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import statistics
+import tracemalloc
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import torch
+import demucs
+import demucs.separate
+from demucs.audio import save_audio
+from separator import Separator
+from separation_pool import SeparationPool
+from audio_reader import PCMStreamReader, ArrayStreamReader
+from stitching import OverlapAddStitcher
+from mixer import StemMixer, pack_stems
+
+try:
+    import resource
+except ImportError:
+    resource = None  # Not on Windows, peak RSS isn't reported there
+
+
+def synthetic_audio(seconds, samplerate=44100, channels=2, seed=0):
+    """
+    Generates a deterministic test signal so benchmarks can run offline.
+    A few detuned tones, a pulse train and some noise give the model something
+    that looks like music to chew on.
+
+    Args:
+        seconds (float): Length of the signal.
+        samplerate (int): Sample rate of the signal.
+        channels (int): Number of channels.
+        seed (int): Seed for the noise component.
+
+    Returns:
+        np.ndarray: float32 array of shape (samples, channels) in [-1, 1].
+    """
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * samplerate)) / samplerate
+    signal = 0.2 * np.sin(2 * np.pi * 110 * t)
+    signal += 0.1 * np.sin(2 * np.pi * 440 * t) * (1 + np.sin(2 * np.pi * 0.5 * t))
+    signal += 0.3 * np.exp(-30 * (t % 0.5)) * np.sin(2 * np.pi * 60 * t)
+    audio = np.stack([signal] * channels, axis=1)
+    audio += 0.02 * rng.standard_normal(audio.shape)
+    return np.clip(audio, -1, 1).astype(np.float32)
+
+
+def summarize(name, timings):
+    timings_ms = [t * 1000 for t in timings]
+    print(f"{name:>10}: mean {statistics.mean(timings_ms):8.1f} ms | "
+          f"median {statistics.median(timings_ms):8.1f} ms | "
+          f"min {min(timings_ms):8.1f} ms | max {max(timings_ms):8.1f} ms")
+
+
+def bench_chunk_latency(model='hdemucs_mmi', chunks=5, chunk_seconds=10.0):
+    """
+    Compares per-chunk latency of launching demucs.separate.main for every chunk
+    (the old processing path) against a resident Separator. Both sides write
+    the four stems as MP3, as processing.py does.
+
+    Args:
+        model (str): The Demucs model name.
+        chunks (int): Number of chunks to separate with each path.
+        chunk_seconds (float): Length of every chunk in seconds.
+    """
+    samplerate = 44100
+    chunk_samples = int(chunk_seconds * samplerate)
+    audio = synthetic_audio(chunk_seconds * chunks, samplerate)
+
+    before = []
+    after = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for i in range(chunks):
+            chunk = audio[i * chunk_samples:(i + 1) * chunk_samples]
+            chunk_file = os.path.join(tmp, f"chunk_{i}.wav")
+            save_audio(torch.from_numpy(chunk.T.copy()), chunk_file, samplerate)
+
+            start_time = time.perf_counter()
+            demucs.separate.main(["--mp3", "-o", tmp, "-n", model, chunk_file])
+            before.append(time.perf_counter() - start_time)
+
+    start_time = time.perf_counter()
+    separator = Separator(model)
+    load_time = time.perf_counter() - start_time
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for i in range(chunks):
+            chunk = audio[i * chunk_samples:(i + 1) * chunk_samples]
+            wav = torch.from_numpy(chunk.T.copy())
+
+            # Writes the stems as MP3 like process_audio_sync, so both sides do the same work
+            start_time = time.perf_counter()
+            sources = separator.separate(wav)
+            for source, name in zip(sources, separator.sources):
+                save_audio(source, os.path.join(tmp, f"chunk_{i}_{name}.mp3"), separator.samplerate)
+            after.append(time.perf_counter() - start_time)
+
+    print(f"\nPer-chunk latency, model '{model}', {chunks} chunks of {chunk_seconds:.1f} s")
+    summarize("per-call", before)
+    summarize("resident", after)
+    print(f"Resident model load (paid once): {load_time * 1000:.1f} ms")
+
+
+def bench_scaling(model='hdemucs_mmi', max_workers=None, chunks=16, chunk_seconds=10.0):
+    """
+    Measures separation throughput of SeparationPool from 1 up to `max_workers`
+    workers. Model loading is excluded, only the steady-state chunk rate counts.
+
+    Args:
+        model (str): The Demucs model name.
+        max_workers (int): Largest pool to try, defaults to the number of cores.
+        chunks (int): Number of chunks separated for every pool size.
+        chunk_seconds (float): Length of every chunk in seconds.
+    """
+    samplerate = 44100
+    chunk_samples = int(chunk_seconds * samplerate)
+    audio = synthetic_audio(chunk_seconds * chunks, samplerate)
+    windows = [(i, audio[i * chunk_samples:(i + 1) * chunk_samples]) for i in range(chunks)]
+    max_workers = max_workers or os.cpu_count() or 1
+
+    print(f"\nScaling, model '{model}', {chunks} chunks of {chunk_seconds:.1f} s")
+    baseline = None
+    # Powers of two up to the largest pool, plus the largest pool itself
+    for workers in sorted({min(2 ** k, max_workers) for k in range(max_workers.bit_length() + 1)}):
+        with SeparationPool(model, workers=workers) as pool:
+            start_time = time.perf_counter()
+            for i, stems in pool.separate_windows(windows):
+                pass
+            elapsed = time.perf_counter() - start_time
+        throughput = chunks * chunk_seconds / elapsed
+        baseline = baseline or throughput
+        print(f"{workers:>3} workers x {pool.threads_per_worker:>2} threads: "
+              f"{throughput:6.2f} s of audio per s | speedup {throughput / baseline:5.2f}x")
+
+
+def bench_batching(model='hdemucs_mmi', batch_sizes=(1, 2, 4, 8), chunks=8, chunk_seconds=10.0):
+    """
+    Compares CPU separation throughput of one chunk per apply_model call
+    against stacking several chunks along the batch dimension.
+
+    Args:
+        model (str): The Demucs model name.
+        batch_sizes (tuple): Batch sizes to try, 1 is the one-chunk-at-a-time path.
+        chunks (int): Number of chunks separated for every batch size.
+        chunk_seconds (float): Length of every chunk in seconds.
+    """
+    samplerate = 44100
+    chunk_samples = int(chunk_seconds * samplerate)
+    audio = synthetic_audio(chunk_seconds * chunks, samplerate)
+    wavs = [torch.from_numpy(audio[i * chunk_samples:(i + 1) * chunk_samples].T.copy()) for i in range(chunks)]
+    separator = Separator(model, device='cpu')
+    separator.separate(wavs[0])  # Warm up
+
+    print(f"\nBatching, model '{model}', {chunks} chunks of {chunk_seconds:.1f} s on CPU")
+    baseline = None
+    for batch_size in batch_sizes:
+        start_time = time.perf_counter()
+        for start in range(0, chunks, batch_size):
+            separator.separate_batch(wavs[start:start + batch_size])
+        elapsed = time.perf_counter() - start_time
+        throughput = chunks * chunk_seconds / elapsed
+        baseline = baseline or throughput
+        print(f"batch {batch_size:>2}: {throughput:6.2f} s of audio per s | "
+              f"{elapsed / chunks * 1000:8.1f} ms per chunk | speedup {throughput / baseline:5.2f}x")
+
+
+def sdr(reference, estimate):
+    """Signal to distortion ratio of `estimate` against `reference` in dB."""
+    error = np.sum((reference - estimate) ** 2) + 1e-12
+    return 10 * np.log10((np.sum(reference ** 2) + 1e-12) / error)
+
+
+def bench_overlap(model='hdemucs_mmi', overlaps=(0, 25, 50, 100, 200), seconds=30.0, chunk_seconds=5.0,
+                  fade='hann'):
+    """
+    Finds how small the chunk overlap can be. Separates the audio chunk by chunk,
+    stitches the chunks with OverlapAddStitcher and compares the result against
+    separating the whole signal in one go.
+
+    Args:
+        model (str): The Demucs model name.
+        overlaps (tuple): Overlaps to try in milliseconds.
+        seconds (float): Length of the test signal.
+        chunk_seconds (float): Length of every chunk's own audio.
+        fade (str): Fade shape of the crossfade.
+    """
+    samplerate = 44100
+    audio = synthetic_audio(seconds, samplerate)
+    separator = Separator(model, device='cpu', shifts=0)  # No random shifts, runs have to be comparable
+    reference = separator.separate_window(audio)
+
+    print(f"\nOverlap, model '{model}', {seconds:.0f} s in chunks of {chunk_seconds:.1f} s, {fade} crossfade")
+    for overlap_ms in overlaps:
+        reader = ArrayStreamReader(audio, samplerate)
+        stitcher = OverlapAddStitcher(overlap_ms * samplerate // 1000, fade)
+        parts = []
+        separated = 0
+        with reader:
+            for i, window in reader.windows(int(chunk_seconds * 1000), overlap_ms):
+                separated += len(window)
+                parts.append(stitcher.push(separator.separate_window(window), reader.pads[i]))
+        parts.append(stitcher.flush())
+        scores = [sdr(reference[name], np.concatenate([part[name] for part in parts]))
+                  for name in separator.sources]
+        print(f"{overlap_ms:>4} ms: SDR vs whole-track separation {statistics.mean(scores):6.2f} dB | "
+              f"audio separated twice {100 * (separated / len(audio) - 1):5.2f}%")
+
+
+def legacy_mix(track_data, tracks, frame_size=1024):
+    """The per-slice mixing loop AudioStreamer used before StemMixer, kept as a baseline."""
+    num_samples = next(iter(track_data.values())).shape[0]
+    for start_idx in range(0, num_samples, frame_size):
+        end_idx = min(start_idx + frame_size, num_samples)
+        frame = None
+        for track in tracks.copy():
+            track_frame = track_data[track][start_idx:end_idx]
+            if frame is None:
+                frame = track_frame.copy()
+            else:
+                frame += track_frame
+        frame *= 0.8
+        (frame * 32767).astype(np.int16).tobytes()
+
+
+def bench_mixer(seconds=60.0, block=4096, repeats=5):
+    """
+    Mixing throughput in frames per second on a single core, for the old
+    per-slice loop and for StemMixer with steady and with ramping gains.
+
+    Args:
+        seconds (float): Length of the stems mixed per run.
+        block (int): Frames StemMixer mixes per call.
+        repeats (int): Runs per variant, the fastest counts.
+    """
+    samplerate = 44100
+    names = ['drums', 'bass', 'other', 'vocals']
+    stacked = np.stack([synthetic_audio(seconds, samplerate, seed=k) for k in range(len(names))])
+    track_data = {name: stacked[k].astype(np.float64) for k, name in enumerate(names)}  # sf.read gave float64
+    num_samples = stacked.shape[1]
+
+    def run_mixer(ramping):
+        mixer = StemMixer(samplerate=samplerate)
+        for n, start in enumerate(range(0, num_samples, block)):
+            if ramping:
+                mixer.set_gain('vocals', n % 2)
+            mixer.mix(stacked[:, start:start + block], names).tobytes()
+
+    variants = [
+        ("legacy loop", lambda: legacy_mix(track_data, names)),
+        ("StemMixer", lambda: run_mixer(False)),
+        ("ramping", lambda: run_mixer(True)),
+    ]
+    print(f"\nMixer, {len(names)} stereo stems, {seconds:.0f} s, blocks of {block} frames, one core")
+    for name, run in variants:
+        best = min(timed(run) for _ in range(repeats))
+        print(f"{name:>12}: {num_samples / best / 1e6:8.2f} M frames/s | {seconds / best:8.0f}x real time")
+
+
+def bench_memory(seconds=600.0, chunk_seconds=10.0, lookahead_seconds=30.0):
+    """
+    Memory held by separated chunks of a long track, for the old per-chunk
+    layout (five float64 arrays read with sf.read, 'original' included) and
+    for stems packed into one int16 (stems, samples, channels) array.
+
+    The look-ahead worth of chunks is built and measured with tracemalloc,
+    the whole track is extrapolated from the per-chunk size.
+
+    Args:
+        seconds (float): Length of the track.
+        chunk_seconds (float): Length of every chunk.
+        lookahead_seconds (float): Audio queued ahead of playback.
+    """
+    samplerate = 44100
+    names = ['drums', 'bass', 'other', 'vocals']
+    stems = {name: synthetic_audio(chunk_seconds, samplerate, seed=k) for k, name in enumerate(names)}
+    chunks = max(1, int(lookahead_seconds // chunk_seconds))
+
+    def legacy_chunk():
+        track_data = {name: stem.astype(np.float64) for name, stem in stems.items()}
+        track_data['original'] = sum(track_data.values())
+        return track_data
+
+    variants = [
+        ("legacy", legacy_chunk),
+        ("float32", lambda: {name: stem.copy() for name, stem in stems.items()}),
+        ("int16", lambda: pack_stems(stems)[1]),
+    ]
+    print(f"\nMemory, {len(names)} stereo stems, {seconds / 60:.0f} min track, chunks of {chunk_seconds:.0f} s, "
+          f"{lookahead_seconds:.0f} s look-ahead")
+    for name, build in variants:
+        tracemalloc.start()
+        queued = [build() for _ in range(chunks)]
+        held, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        per_chunk = held / len(queued)
+        print(f"{name:>8}: {per_chunk / 2 ** 20:7.1f} MiB per chunk | "
+              f"{held / 2 ** 20:7.1f} MiB look-ahead | "
+              f"{per_chunk * seconds / chunk_seconds / 2 ** 20:8.1f} MiB whole track")
+
+
+def read_audio(path, samplerate=44100, channels=2):
+    """Decodes a whole file with ffmpeg into a float32 array of shape (samples, channels)."""
+    blocks = []
+    with PCMStreamReader(path, samplerate, channels) as reader:
+        while True:
+            block = reader.read(10 * samplerate)
+            if len(block) == 0:
+                break
+            blocks.append(block)
+    return np.concatenate(blocks) if blocks else np.zeros((0, channels), dtype=np.float32)
+
+
+class _TimedSeparator:
+    """Passes everything through to a Separator and notes when each chunk's stems came out."""
+
+    def __init__(self, separator):
+        self.separator = separator
+        self.done = []
+
+    def __getattr__(self, name):
+        return getattr(self.separator, name)
+
+    def separate(self, wav):
+        sources = self.separator.separate(wav)
+        self.done.append(time.perf_counter())
+        return sources
+
+
+def _peak_rss():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024  # Bytes on macOS, KiB elsewhere
+
+
+def _disk_bytes(root):
+    return sum(os.path.getsize(os.path.join(directory, name))
+               for directory, _, names in os.walk(root) for name in names)
+
+
+def _suite_run(path, audio_file, model, chunk_seconds, workdir):
+    """One suite run, in a fresh process so peak RSS and the model load belong to it alone."""
+    os.chdir(workdir)  # process_audio_sync writes its chunks relative to the working directory
+    samplerate = 44100
+    start_time = time.perf_counter()
+    if path == 'sync':
+        import processing
+        processing.chunk_length_ms = int(chunk_seconds * 1000)
+        separator = _TimedSeparator(Separator(model))
+        processing.process_audio_sync(audio_file, model, separator)
+        done = separator.done
+    else:
+        import test  # Pulls in yt_dlp, pyaudio and PyQt5, only needed for this path
+        audio = (read_audio(audio_file, samplerate) * 32767).astype(np.int16)
+        chunk_samples = int(chunk_seconds * samplerate)
+        done = []
+        for start in range(0, len(audio), chunk_samples):
+            test.process(audio[start:start + chunk_samples].flatten(), model=model)
+            done.append(time.perf_counter())
+    elapsed = time.perf_counter() - start_time
+
+    latencies = np.diff([start_time] + done) * 1000
+    return {
+        'path': path,
+        'model': model,
+        'chunk_seconds': chunk_seconds,
+        'chunks': len(done),
+        'elapsed_seconds': elapsed,
+        'time_to_first_chunk_seconds': done[0] - start_time if done else None,
+        'latency_ms': {f'p{q}': float(np.percentile(latencies, q)) for q in (50, 90, 99)} if done else None,
+        'peak_rss_bytes': _peak_rss(),
+        'disk_bytes_written': _disk_bytes(workdir),
+    }
+
+
+def bench_suite(models=('hdemucs_mmi',), chunk_seconds=(5.0, 10.0), seconds=60.0, audio_file=None,
+                paths=('sync',), output=None):
+    """
+    Runs the separation paths end to end for every model and chunk size and
+    reports the results as JSON, so runs can be compared across versions.
+
+    'sync' is processing.process_audio_sync, which writes MP3 chunks to disk,
+    'test' is test.process, which loads the model again for every chunk and
+    keeps everything in memory and needs PyQt5 on top of the requirements. Every
+    run gets its own process and working directory, a run that fails is recorded
+    with its error and the others go on. Time to first chunk and chunk latencies count from the start of
+    the run, model loading included, to each chunk's stems being separated.
+
+    Args:
+        models (tuple): Demucs model names.
+        chunk_seconds (tuple): Chunk lengths to try.
+        seconds (float): Length of the synthetic signal, unused with `audio_file`.
+        audio_file (str): Audio to separate instead of the synthetic signal.
+        paths (tuple): Separation paths to run, 'sync' and/or 'test'.
+        output (str): File the JSON goes to, stdout if None.
+
+    Returns:
+        dict: The report.
+    """
+    samplerate = 44100
+    with tempfile.TemporaryDirectory() as tmp:
+        audio = read_audio(audio_file, samplerate) if audio_file else synthetic_audio(seconds, samplerate)
+        input_file = os.path.join(tmp, "input.wav")
+        save_audio(torch.from_numpy(audio.T.copy()), input_file, samplerate)
+        audio_seconds = len(audio) / samplerate
+
+        runs = []
+        for model in models:
+            for length in chunk_seconds:
+                for path in paths:
+                    workdir = tempfile.mkdtemp(dir=tmp)
+                    try:
+                        with ProcessPoolExecutor(max_workers=1,
+                                                 mp_context=multiprocessing.get_context('spawn')) as pool:
+                            run = pool.submit(_suite_run, path, input_file, model, length, workdir).result()
+                    except Exception as e:
+                        runs.append({'path': path, 'model': model, 'chunk_seconds': length,
+                                     'error': f"{type(e).__name__}: {e}"})
+                        print(f"{path:>5} {model} {length:5.1f} s chunks: failed, {type(e).__name__}: {e}",
+                              file=sys.stderr)
+                        continue
+                    run['rtf'] = run['elapsed_seconds'] / audio_seconds
+                    runs.append(run)
+                    latency = run['latency_ms'] or {}
+                    print(f"{path:>5} {model} {length:5.1f} s chunks: RTF {run['rtf']:.3f} | "
+                          f"first chunk {run['time_to_first_chunk_seconds'] or 0:6.2f} s | "
+                          f"p50 {latency.get('p50', 0):8.1f} ms | p99 {latency.get('p99', 0):8.1f} ms | "
+                          f"peak RSS {(run['peak_rss_bytes'] or 0) / 2 ** 20:7.1f} MiB | "
+                          f"disk {run['disk_bytes_written'] / 2 ** 20:7.1f} MiB", file=sys.stderr)
+
+    report = {
+        'created': time.time(),
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'torch': torch.__version__,
+        'demucs': demucs.__version__,
+        'cpu_count': os.cpu_count(),
+        'audio': {'source': audio_file or 'synthetic', 'seconds': audio_seconds},
+        'runs': runs,
+    }
+    if output is None:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {len(runs)} runs to {output}", file=sys.stderr)
+    return report
+
+
+def timed(run):
+    start_time = time.perf_counter()
+    run()
+    return time.perf_counter() - start_time
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="TrackFusion separation benchmarks")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    latency = subparsers.add_parser("latency", help="per-chunk latency, per-call demucs vs resident model")
+    latency.add_argument("--model", default="hdemucs_mmi")
+    latency.add_argument("--chunks", type=int, default=5)
+    latency.add_argument("--chunk-seconds", type=float, default=10.0)
+
+    scaling = subparsers.add_parser("scaling", help="parallel separation throughput from 1 to N workers")
+    scaling.add_argument("--model", default="hdemucs_mmi")
+    scaling.add_argument("--max-workers", type=int, default=None)
+    scaling.add_argument("--chunks", type=int, default=16)
+    scaling.add_argument("--chunk-seconds", type=float, default=10.0)
+
+    batching = subparsers.add_parser("batching", help="batched vs one-chunk-at-a-time separation on CPU")
+    batching.add_argument("--model", default="hdemucs_mmi")
+    batching.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 2, 4, 8])
+    batching.add_argument("--chunks", type=int, default=8)
+    batching.add_argument("--chunk-seconds", type=float, default=10.0)
+
+    overlap = subparsers.add_parser("overlap", help="stitching quality against chunk overlap")
+    overlap.add_argument("--model", default="hdemucs_mmi")
+    overlap.add_argument("--overlaps", type=int, nargs="+", default=[0, 25, 50, 100, 200])
+    overlap.add_argument("--seconds", type=float, default=30.0)
+    overlap.add_argument("--chunk-seconds", type=float, default=5.0)
+    overlap.add_argument("--fade", default="hann", choices=["linear", "hann", "equal_power"])
+
+    mixer = subparsers.add_parser("mixer", help="stem mixing frames per second per core")
+    mixer.add_argument("--seconds", type=float, default=60.0)
+    mixer.add_argument("--block", type=int, default=4096)
+
+    memory = subparsers.add_parser("memory", help="memory held by separated chunks of a long track")
+    memory.add_argument("--seconds", type=float, default=600.0)
+    memory.add_argument("--chunk-seconds", type=float, default=10.0)
+    memory.add_argument("--lookahead-seconds", type=float, default=30.0)
+
+    suite = subparsers.add_parser("suite", help="end-to-end separation runs per model and chunk size, as JSON")
+    suite.add_argument("--models", nargs="+", default=["hdemucs_mmi"])
+    suite.add_argument("--chunk-seconds", type=float, nargs="+", default=[5.0, 10.0])
+    suite.add_argument("--seconds", type=float, default=60.0, help="length of the synthetic signal")
+    suite.add_argument("--audio", default=None, help="audio file to separate instead of the synthetic signal")
+    suite.add_argument("--paths", nargs="+", default=["sync"], choices=["sync", "test"],
+                       help="'test' also needs PyQt5, which isn't in requirements.txt")
+    suite.add_argument("--output", default=None, help="JSON file to write, stdout if omitted")
+
+    args = parser.parse_args(sys.argv[1:])
+    if args.command == "latency":
+        bench_chunk_latency(args.model, args.chunks, args.chunk_seconds)
+    elif args.command == "scaling":
+        bench_scaling(args.model, args.max_workers, args.chunks, args.chunk_seconds)
+    elif args.command == "batching":
+        bench_batching(args.model, args.batch_sizes, args.chunks, args.chunk_seconds)
+    elif args.command == "overlap":
+        bench_overlap(args.model, args.overlaps, args.seconds, args.chunk_seconds, args.fade)
+    elif args.command == "mixer":
+        bench_mixer(args.seconds, args.block)
+    elif args.command == "memory":
+        bench_memory(args.seconds, args.chunk_seconds, args.lookahead_seconds)
+    elif args.command == "suite":
+        bench_suite(args.models, args.chunk_seconds, args.seconds, args.audio, args.paths, args.output)
@@ -0,0 +1,78 @@
+import json
+import struct
+import numpy as np
+
+# Every frame is: header length, payload length, JSON header, raw stem payload
+FRAME_PREFIX = struct.Struct('<II')
+
+
+def write_chunk(stream, i, stems, samplerate, pads=(0, 0), degraded=False):
+    """
+    Writes one separated chunk as a frame.
+
+    Args:
+        stream: Binary file object, e.g. the processing subprocess's stdout.
+        i (int): Chunk index.
+        stems (dict): Stem name mapped to an array of shape (samples, channels).
+        samplerate (int): Sample rate of the stems.
+        pads (tuple): Samples of overlap before and after the chunk's own audio.
+        degraded (bool): Whether this or an earlier chunk was separated below the best quality.
+    """
+    names = list(stems)
+    stacked = np.ascontiguousarray(np.stack([stems[name] for name in names]))
+    header = json.dumps({
+        'index': i,
+        'sources': names,
+        'samplerate': samplerate,
+        'shape': stacked.shape,
+        'dtype': stacked.dtype.str,
+        'pads': list(pads),
+        'degraded': degraded,
+    }).encode()
+    stream.write(FRAME_PREFIX.pack(len(header), stacked.nbytes))
+    stream.write(header)
+    stream.write(stacked.data)
+    stream.flush()
+
+
+def write_end(stream):
+    """Tells the reader that no more chunks follow."""
+    header = json.dumps({'end': True}).encode()
+    stream.write(FRAME_PREFIX.pack(len(header), 0))
+    stream.write(header)
+    stream.flush()
+
+
+def _read_exact(stream, size):
+    data = bytearray(size)
+    view = memoryview(data)
+    read = 0
+    while read < size:
+        n = stream.readinto(view[read:])
+        if not n:
+            raise EOFError("Chunk channel closed in the middle of a frame")
+        read += n
+    return data
+
+
+def read_chunk(stream):
+    """
+    Blocks until the next frame arrives.
+
+    Returns:
+        tuple: (chunk index, dict of stem name -> array of shape (samples, channels),
+                sample rate, (samples of overlap before, after), whether separation was
+                degraded so far), or None once the writer has finished or the channel was closed.
+    """
+    prefix = stream.read(FRAME_PREFIX.size)
+    if len(prefix) < FRAME_PREFIX.size:
+        return None
+    header_size, payload_size = FRAME_PREFIX.unpack(prefix)
+    header = json.loads(bytes(_read_exact(stream, header_size)))
+    if header.get('end'):
+        return None
+
+    payload = _read_exact(stream, payload_size)
+    stacked = np.frombuffer(payload, dtype=np.dtype(header['dtype'])).reshape(header['shape'])
+    stems = {name: stacked[k] for k, name in enumerate(header['sources'])}
+    return header['index'], stems, header['samplerate'], tuple(header['pads']), header.get('degraded', False)
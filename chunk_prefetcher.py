@@ -0,0 +1,76 @@
+import queue
+import threading
+import numpy as np
+
+
+class ChunkPrefetcher:
+    def __init__(self, source_queue, depth=2, stop_event=None, is_stale=None):
+        """
+        Turns queued chunks into ready-to-mix arrays on a worker thread, up to
+        `depth` chunks ahead of playback.
+
+        Chunks from the cache are memory-mapped views, so reading them touches
+        the disk. Doing that here keeps all I/O and copying off the thread
+        that feeds the output device.
+
+        Args:
+            source_queue (queue.Queue): Yields (tag, chunk) pairs, chunk being (start frame, stem names,
+                                        array of shape (stems, samples, channels), sample rate) or None
+                                        at the end of a stream.
+            depth (int): Most chunks kept ready at once.
+            stop_event (threading.Event): Stops the worker when set.
+            is_stale (callable): Called with every tag, chunks it returns True for are dropped unread.
+        """
+        self.source_queue = source_queue
+        self.ready = queue.Queue(maxsize=max(1, depth))
+        self.stop_event = stop_event or threading.Event()
+        self.is_stale = is_stale
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            try:
+                tag, chunk = self.source_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if self.is_stale is not None and self.is_stale(tag):
+                continue
+            if chunk is not None:
+                start, names, stacked, samplerate = chunk
+                # One contiguous block, this is where memory-mapped chunks are read
+                chunk = (start, names, np.ascontiguousarray(stacked), samplerate)
+            if not self._put((tag, chunk)):
+                return
+
+    def _put(self, item):
+        while not self.stop_event.is_set():
+            try:
+                self.ready.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def get(self, timeout=None):
+        """
+        Blocks until the next chunk is ready, or for at most `timeout` seconds.
+
+        Returns:
+            tuple: (tag, (start frame, stem names, array of shape (stems, samples, channels), sample rate)),
+                   (tag, None) at the end of a stream, or None when stopped or timed out.
+        """
+        if timeout is not None:
+            try:
+                return self.ready.get(timeout=timeout) if timeout > 0 else self.ready.get_nowait()
+            except queue.Empty:
+                return None
+        while not self.stop_event.is_set():
+            try:
+                return self.ready.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return None
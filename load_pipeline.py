@@ -0,0 +1,129 @@
+import threading
+import traceback
+from math import floor
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import syncedlyrics
+from PyQt6.QtCore import QObject, pyqtSignal
+from ytdl import resolve_streams
+from play_audio import AudioStreamer
+from video_decoder import VideoDecoder
+
+
+def parse_lyrics(lyrics):
+    """Turns LRC lyrics into (start in ms, line) pairs."""
+    lines = lyrics.splitlines()
+    for i in range(len(lines)):
+        minutes, seconds = lines[i][1:9].split(":")
+        minutes, seconds = int(minutes), float(seconds)
+        milliseconds = int(floor((minutes * 60 + seconds) * 1000))
+        lines[i] = (milliseconds, lines[i][lines[i].index(']')+1:].strip())
+    return lines
+
+
+class LoadPipeline(QObject):
+    # (stage, message) whenever a stage starts or finishes
+    progress = pyqtSignal(str, str)
+    # Info dict, once the metadata is resolved
+    resolved = pyqtSignal(dict)
+    # AudioStreamer that is already playing and separating
+    audioReady = pyqtSignal(object)
+    # VideoDecoder that is already decoding
+    videoReady = pyqtSignal(object)
+    # List of (start in ms, line), None if no synced lyrics were found
+    lyricsReady = pyqtSignal(object)
+    # (stage, error message)
+    failed = pyqtSignal(str, str)
+
+    def __init__(self, url, clock, ytm_api, streamer_options, parent=None):
+        """
+        Loads a song off the GUI thread: resolves the metadata and stream URLs,
+        then starts audio with separation, opens the video and fetches the
+        lyrics concurrently. Signals are delivered in the GUI thread.
+
+        Audio isn't downloaded first, ffmpeg reads the stream URL and separation
+        starts on the first bytes that arrive. Nothing but `audioReady` and
+        `videoReady` is emitted after `cancel`, the receiver has to stop players
+        that arrive for a cancelled pipeline.
+
+        Args:
+            url (str): YouTube link.
+            clock (callable): Playback position in milliseconds, the video follows it.
+            ytm_api: ytm.YouTubeMusic used to look up the song for its lyrics.
+            streamer_options (dict): Further AudioStreamer arguments.
+            parent (QObject): Qt parent.
+        """
+        super().__init__(parent)
+        self.url = url
+        self.clock = clock
+        self.ytm_api = ytm_api
+        self.streamer_options = streamer_options
+        self.cancelled = threading.Event()
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+
+    def cancel(self):
+        """Stops delivering results. Network calls in flight finish in the background and are dropped."""
+        self.cancelled.set()
+
+    def _emit(self, signal, *args):
+        if not self.cancelled.is_set():
+            signal.emit(*args)
+
+    def _run(self):
+        try:
+            self._emit(self.progress, 'metadata', "Resolving streams")
+            video_url, audio_url, audio_headers, info_dict = resolve_streams(self.url)
+        except Exception as e:
+            self._emit(self.failed, 'metadata', str(e))
+            return
+        if self.cancelled.is_set():
+            return
+        self._emit(self.resolved, info_dict)
+
+        stages = {
+            'audio': lambda: self._start_audio(audio_url, audio_headers, info_dict),
+            'video': lambda: self._open_video(video_url),
+            'lyrics': lambda: self._fetch_lyrics(info_dict),
+        }
+        with ThreadPoolExecutor(max_workers=len(stages)) as executor:
+            futures = {executor.submit(run): stage for stage, run in stages.items()}
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    traceback.print_exc()
+                    self._emit(self.failed, futures[future], str(e))
+
+    def _start_audio(self, audio_url, audio_headers, info_dict):
+        self._emit(self.progress, 'audio', "Streaming audio")
+        streamer = AudioStreamer(audio_url, cache_id=f"youtube:{info_dict['id']}", source_headers=audio_headers,
+                                 **self.streamer_options)
+        cached = streamer.is_cached()
+        if self.cancelled.is_set():
+            streamer.p.terminate()
+            return
+        streamer.start()
+        self._emit(self.progress, 'separation', "Playing from the stem cache" if cached else "Separating")
+        # Always handed over, even if cancelled meanwhile, MainWindow stops players of stale searches
+        self.audioReady.emit(streamer)
+
+    def _open_video(self, video_url):
+        self._emit(self.progress, 'video', "Opening video")
+        video = VideoDecoder(video_url, self.clock)
+        video.start()
+        self.videoReady.emit(video)  # Like audioReady, MainWindow stops it if the search is stale
+
+    def _fetch_lyrics(self, info_dict):
+        self._emit(self.progress, 'lyrics', "Fetching lyrics")
+        lyrics = None
+        res = self.ytm_api.search_songs(info_dict['title'])['items'][0]
+        song_name = res['name'] or 'Unknown'
+        artist_name = res['artists'][0]['name'] or 'Unknown'
+        if song_name != 'Unknown' and artist_name != 'Unknown':
+            lyrics = syncedlyrics.search(f"[{song_name}] [{artist_name}]", synced_only=True)
+        elif song_name != 'Unknown':
+            lyrics = syncedlyrics.search(f"[{song_name}]", synced_only=True)
+        self._emit(self.lyricsReady, parse_lyrics(lyrics) if lyrics else None)
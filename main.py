@@ -1,25 +1,31 @@
 import sys
 import re
-import cv2
 import ytm
-import imageio.v3 as iio
 from pygame import mixer
-from math import floor
 from PyQt6.QtWidgets import (QWidget, QLabel, QApplication, QLineEdit, QTextEdit, QVBoxLayout, 
-                             QHBoxLayout, QPushButton, QCheckBox, QStyledItemDelegate, QCompleter,)
-from PyQt6.QtCore import QTimer, QSize, Qt, QRect, QStringListModel
-from PyQt6.QtGui import QPixmap, QImage, QColor, QFont
-from ytdl import download_video_and_audio
-import syncedlyrics
+                             QHBoxLayout, QPushButton, QCheckBox, QStyledItemDelegate, QCompleter, QSlider, QAbstractSlider,)
+from PyQt6.QtCore import QTimer, QSize, Qt, QRect, QStringListModel, pyqtSignal
+from PyQt6.QtGui import QPixmap, QColor, QFont
 import signal
-from play_audio import AudioStreamer
+from load_pipeline import LoadPipeline
+from play_audio import SeparationEngine
+from separation_pool import default_workers
+from stem_cache import StemCache
+from suggestions import SuggestionService, YouTubeMusicBackend, StubBackend
+from thumbnails import ThumbnailService, thumbnail_url
 import shutil
 import os
 import traceback
 
 model = 'hdemucs_mmi'
+workers = default_workers()
+lookahead_seconds = 30  # how far separation may run ahead of playback
+offline_suggestions = False  # answer the search bar with made-up suggestions, no network needed
 
 class MainWindow(QWidget):
+    # (query, suggestions), emitted from a suggestion worker thread and delivered in the GUI thread
+    suggestionsReady = pyqtSignal(str, list)
+
     def __init__(self):
         super().__init__()
 
@@ -62,13 +68,17 @@ class MainWindow(QWidget):
 
         # Initialize QTimer
         self.timer = QTimer(self)
-        self.timer.setInterval(800) 
+        self.timer.setInterval(300)  # Lookups don't block the GUI anymore, a short pause is enough
         self.timer.setSingleShot(True)
         self.timer.timeout.connect(self.show_completer)
 
         # Connect textChanged signal to restart timer
         self.searchBar.textChanged.connect(self.on_text_changed)
 
+        # Suggestions are looked up on worker threads and cached by query
+        self.suggestions = SuggestionService(StubBackend() if offline_suggestions else YouTubeMusicBackend())
+        self.suggestionsReady.connect(self.on_suggestions_ready)
+
 
         # Initialize Completer
         self.completer = QCompleter(self)
@@ -79,9 +89,11 @@ class MainWindow(QWidget):
         self.completer.setCaseSensitivity(Qt.CaseSensitivity.CaseInsensitive)
         self.completer.activated.connect(self.on_suggestion_selected)
 
-        # Set custom delegate
-        delegate = AutocompleteDelegate(self.completer.popup())
+        # Set custom delegate, thumbnails are fetched in the background and scaled once
+        self.thumbnails = ThumbnailService(QSize(40, 40), disk_dir='cache/thumbnails', parent=self)
+        delegate = AutocompleteDelegate(self.thumbnails, self.completer.popup())
         self.completer.popup().setItemDelegate(delegate)
+        self.thumbnails.ready.connect(self.completer.popup().viewport().update)
 
         # Optional: Adjust completer popup size
         self.completer.popup().setMinimumWidth(500)
@@ -98,10 +110,19 @@ class MainWindow(QWidget):
         self.checkbox3.setChecked(True)
         self.checkbox4.setChecked(True)
 
-        checkboxLayout.addWidget(self.checkbox1)
-        checkboxLayout.addWidget(self.checkbox2)
-        checkboxLayout.addWidget(self.checkbox3)
-        checkboxLayout.addWidget(self.checkbox4)
+        # Volume slider under every checkbox, the checkbox still mutes the stem
+        self.volumeSliders = {}
+        for checkbox in (self.checkbox1, self.checkbox2, self.checkbox3, self.checkbox4):
+            slider = QSlider(Qt.Orientation.Horizontal, self)
+            slider.setRange(0, 100)
+            slider.setValue(100)
+            slider.valueChanged.connect(self.onCheckboxChange)
+            self.volumeSliders[checkbox.text()] = slider
+
+            stemLayout = QVBoxLayout()
+            stemLayout.addWidget(checkbox)
+            stemLayout.addWidget(slider)
+            checkboxLayout.addLayout(stemLayout)
 
         # on checkbox change
         self.checkbox1.stateChanged.connect(self.onCheckboxChange)
@@ -119,8 +140,7 @@ class MainWindow(QWidget):
         """)
 
         self.isRenderingVideo = False
-        self.video = None
-        self.videoFPS = None
+        self.video = None  # VideoDecoder, decodes on its own thread
         self.videoTimer = None  # Initialize video timer to None
         
         self.videoLabel.setPixmap(QPixmap(600, 540))
@@ -146,6 +166,21 @@ class MainWindow(QWidget):
         videoControlLayout.addWidget(self.playButton)
         videoControlLayout.addWidget(self.pauseButton)
 
+        # Seek bar in milliseconds, follows playback unless it is being dragged
+        self.seekBar = QSlider(Qt.Orientation.Horizontal, self)
+        self.seekBar.setRange(0, 0)
+        # the range is in ms, every seek restarts decoding so keys and the wheel take whole steps
+        self.seekBar.setSingleStep(5000)
+        self.seekBar.setPageStep(10000)
+        self.seekBar.sliderReleased.connect(self.onSeekBarReleased)
+        # clicks on the groove, arrow keys and the wheel move the slider without a release
+        self.seekBar.actionTriggered.connect(self.onSeekBarAction)
+        videoControlLayout.addWidget(self.seekBar)
+
+        self.seekTimer = QTimer(self)
+        self.seekTimer.setInterval(250)
+        self.seekTimer.timeout.connect(self.updateSeekBar)
+
         ### Create lyricsLabel that holds lyrics
         lyricBoxLayout = QVBoxLayout()
 
@@ -205,84 +240,130 @@ class MainWindow(QWidget):
         self.setLayout(screenLayout)
 
         self.ytm_api = ytm.YouTubeMusic()
+        self.loader = None  # LoadPipeline of the latest search
+        # separation model loads with the first song and stays warm for the next ones
+        self.engine = SeparationEngine(model, workers)
+        # separated stems outlive temp so replayed songs skip separation
+        self.stem_cache = StemCache('cache/stems')
         # clear temp folder
         shutil.rmtree('temp', ignore_errors=True)
         os.makedirs('temp', exist_ok=True)
 
     def onCheckboxChange(self):
-        options = []
-        if self.checkbox1.isChecked():
-            options.append('vocals')
-        if self.checkbox2.isChecked():
-            options.append('bass')
-        if self.checkbox3.isChecked():
-            options.append('drums')
-        if self.checkbox4.isChecked():
-            options.append('other')
+        volumes = {}
+        for checkbox in (self.checkbox1, self.checkbox2, self.checkbox3, self.checkbox4):
+            stem = checkbox.text()
+            volumes[stem] = self.volumeSliders[stem].value() / 100 if checkbox.isChecked() else 0.0
 
         if self.audio_streamer:
-            self.audio_streamer.change_tracks(options)
+            self.audio_streamer.set_volumes(volumes)
 
     def onSearchButtonClick(self):
+        if self.loader is not None:
+            self.loader.cancel()  # Drops whatever the previous search is still loading
+            self.loader = None
         if self.audio_streamer:
             self.audio_streamer.stop()
             self.audio_streamer = None
+        if self.videoTimer is not None:
+            self.videoTimer.stop()
+        if self.video is not None:
+            self.video.stop()
+            self.video = None
+        self.lyricsTimer.stop()
+        self.isRenderingLyrics = False
+        self.lyricBox.setText('')
+        self.seekTimer.stop()
         
         # reset all comboboxes
         self.checkbox1.setChecked(True)
         self.checkbox2.setChecked(True)
         self.checkbox3.setChecked(True)
         self.checkbox4.setChecked(True)
+        for slider in self.volumeSliders.values():
+            slider.setValue(100)
 
 
         youTubeLinkRegex = re.compile(r'^(https?://)?(www\.)?(youtube\.com|youtu\.be)/(watch\?v=|embed/|v/)?([A-Za-z0-9_-]{11})(&.*)*$') #Test Later
 
         if (youTubeLinkRegex.fullmatch(self.searchBar.text())):
-            video_url, audio_path, info_dict = download_video_and_audio(self.searchBar.text(), output_dir='temp')
-            ### Video setup
+            # Every stage runs off the GUI thread, the results arrive through the pipeline's signals
             self.isRenderingVideo = True
-            self.video = cv2.VideoCapture(video_url)
-            self.videoFPS = self.video.get(cv2.CAP_PROP_FPS)
-
-            # Setup video timer
+            self.loader = LoadPipeline(self.searchBar.text(), self.audioPosition, self.ytm_api, {
+                'root_dir': f'temp/{model}', 'model': model, 'in_memory': True, 'workers': workers,
+                'cache': self.stem_cache, 'lookahead_seconds': lookahead_seconds, 'engine': self.engine,
+            })
+            self.loader.progress.connect(self.onLoadProgress)
+            self.loader.resolved.connect(self.onLoadResolved)
+            self.loader.audioReady.connect(self.onAudioReady)
+            self.loader.videoReady.connect(self.onVideoReady)
+            self.loader.lyricsReady.connect(self.onLyricsReady)
+            self.loader.failed.connect(self.onLoadFailed)
+            self.loader.start()
+
+    def isCurrentLoad(self):
+        """Whether the signal being handled comes from the pipeline of the latest search."""
+        return self.loader is not None and self.sender() is self.loader
+
+    def onLoadProgress(self, stage, message):
+        if self.isCurrentLoad():
+            print(f"[{stage}] {message}")
+            self.setWindowTitle(f"TrackFusion - {message}")
+
+    def onLoadFailed(self, stage, error):
+        if self.isCurrentLoad():
+            print(f"Loading failed at {stage}: {error}")
+            self.setWindowTitle(f"TrackFusion - {stage} failed")
+
+    def onLoadResolved(self, info_dict):
+        if self.isCurrentLoad():
+            self.setWindowTitle(f"TrackFusion - {info_dict.get('title', '')}")
+            self.seekBar.setRange(0, int((info_dict.get('duration') or 0) * 1000))
+            self.seekBar.setValue(0)
+
+    def onAudioReady(self, audio_streamer):
+        if not self.isCurrentLoad():
+            audio_streamer.stop()  # A newer search started while this one was starting up
+            return
+        ### Audio setup
+        self.audio_streamer = audio_streamer
+        if not self.isRenderingVideo:
+            self.audio_streamer.pause()  # Paused while loading
+        signal.signal(signal.SIGINT, self.audio_streamer.handle_signal)  # Handle CTRL+C
+        self.seekTimer.start()
+
+    def onVideoReady(self, video):
+        if not self.isCurrentLoad():
+            video.stop()
+            return
+        ### Video setup
+        self.video = video
+
+        # Setup video timer, it only shows frames the decoder has ready
+        if self.videoTimer is None:
             self.videoTimer = QTimer(self)
-            self.videoTimer.setInterval(int(1000 / self.videoFPS))  # Update video every frame
+            self.videoTimer.setInterval(10)  # Often enough to show every frame close to when it is due
             self.videoTimer.timeout.connect(self.updateVideoFrame)
+        if self.isRenderingVideo:
             self.videoTimer.start()
-        
-            ### Audio setup
-            self.audio_streamer = AudioStreamer(audio_path, f'temp/{model}')
-            signal.signal(signal.SIGINT, self.audio_streamer.handle_signal)  # Handle CTRL+C
-            self.audio_streamer.start()
-            
-            ### Lyric setup
-            lyrics = None
-            res = self.ytm_api.search_songs(info_dict['title'])['items'][0]
-            song_name = res['name'] or 'Unknown'
-            artist_name = res['artists'][0]['name'] or 'Unknown'
-            if song_name != 'Unknown' and artist_name != 'Unknown':
-                lyrics = syncedlyrics.search(f"[{song_name}] [{artist_name}]", synced_only=True)
-            elif song_name != 'Unknown':
-                lyrics = syncedlyrics.search(f"[{song_name}]", synced_only=True)
-            
-            if not lyrics:
-                lyrics = 'No lyrics found'
-                self.lyricBox.setText(lyrics)
-            else:
-                self.isRenderingLyrics = True
-                tempLyrics = lyrics.splitlines()
-                for i in range(len(tempLyrics)):
-                    minutes, seconds = tempLyrics[i][1:9].split(":")
-                    minutes, seconds = int(minutes), float(seconds)
-                    milliseconds = int(floor((minutes * 60 + seconds) * 1000))
-                    tempLyrics[i] = (milliseconds, tempLyrics[i][tempLyrics[i].index(']')+1:].strip())
-                self.lyrics = tempLyrics
-                self.lyricIndex = 0
-                self.updateLyrics()
+
+    def onLyricsReady(self, lyrics):
+        if not self.isCurrentLoad():
+            return
+        ### Lyric setup
+        if not lyrics:
+            self.lyricBox.setText('No lyrics found')
+        else:
+            self.isRenderingLyrics = True
+            self.lyrics = lyrics
+            self.lyricIndex = 0
+            self.updateLyrics()
+            if self.isRenderingVideo:
                 self.lyricsTimer.start()  # Start lyrics timer
 
     def onPlayButtonClicked(self):
-        self.audio_streamer.play()
+        if self.audio_streamer:
+            self.audio_streamer.play()
         self.isRenderingVideo = True
         if self.videoTimer is not None:
             self.videoTimer.start()
@@ -290,7 +371,8 @@ class MainWindow(QWidget):
             self.lyricsTimer.start()
 
     def onPauseButtonClicked(self):
-        self.audio_streamer.pause()
+        if self.audio_streamer:
+            self.audio_streamer.pause()
         self.isRenderingVideo = False
         if self.videoTimer is not None:
             self.videoTimer.stop()
@@ -298,37 +380,48 @@ class MainWindow(QWidget):
             self.lyricsTimer.stop()
 
 
-    def updateVideoFrame(self):
-        try:
-            if self.isRenderingVideo:
-                # Get the current audio position in milliseconds and calculate corresponding frame number
-                current_audio_position = self.audio_streamer.get_pos()
-                frameNumber = current_audio_position * self.videoFPS / 1000
+    def onSeekBarReleased(self):
+        self.seekTo(self.seekBar.value())
+
+    def onSeekBarAction(self, action):
+        # dragging seeks once on release, updateSeekBar uses setValue and triggers no action
+        if action in (QAbstractSlider.SliderAction.SliderMove, QAbstractSlider.SliderAction.SliderNoAction):
+            return
+        # the value isn't updated yet when the action is signalled, the slider position is
+        self.seekTo(self.seekBar.sliderPosition())
 
-                current_frame_number = self.video.get(cv2.CAP_PROP_POS_FRAMES)
-                if current_frame_number > frameNumber:
-                    self.video.set(cv2.CAP_PROP_POS_FRAMES, frameNumber)
+    def seekTo(self, position):
+        if not self.audio_streamer:
+            return
+        self.audio_streamer.seek(position)
+        if self.video is not None:
+            self.video.seek(position)
+        if self.isRenderingLyrics:
+            # Show the last line that starts before the new position
+            self.lyricIndex = 0
+            while self.lyricIndex < len(self.lyrics) - 1 and self.lyrics[self.lyricIndex+1][0] <= position:
+                self.lyricIndex = self.lyricIndex + 1
+            self.updateLyrics()
 
+    def updateSeekBar(self):
+        if self.audio_streamer and not self.seekBar.isSliderDown():
+            self.seekBar.setValue(int(self.audio_streamer.get_pos()))
 
-                # Handle the case when audio stream position is not available immediately
-                if current_audio_position == 0:
-                    print("Waiting for audio stream to start...")
-                    return  # Optionally, could add a delay or retry mechanism here
+    def audioPosition(self):
+        """Playback position in milliseconds, the clock the video follows."""
+        audio_streamer = self.audio_streamer
+        return audio_streamer.get_pos() if audio_streamer else 0
 
-                # Retrieve the frame from the video
-                ret, frame = self.video.read()
-                if not ret:
-                    print("Failed to retrieve frame")
+    def updateVideoFrame(self):
+        try:
+            if self.isRenderingVideo:
+                # The decoder thread already decoded and skipped frames by the audio clock, only blit here
+                frameImage = self.video.take()
+                if frameImage is not None:
+                    self.videoLabel.setPixmap(QPixmap.fromImage(frameImage))
+                elif self.video.done:
+                    print("Reached the end of the video")
                     self.videoTimer.stop()
-                    return
-                
-                # Convert the frame to RGB format for display
-                frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                h, w, ch = frame.shape
-                bytesPerLine = ch * w
-                frameImage = QImage(frame.data, w, h, bytesPerLine, QImage.Format.Format_RGB888)
-                frameImagePixmap = QPixmap.fromImage(frameImage)
-                self.videoLabel.setPixmap(frameImagePixmap)
                     
         except Exception as e:
             print(f"Error rendering video: {e}")
@@ -336,7 +429,8 @@ class MainWindow(QWidget):
 
 
     def renderLyrics(self):
-        if self.isRenderingLyrics:
+        # Lyrics can arrive before the audio, or without it if the audio stage failed
+        if self.isRenderingLyrics and self.audio_streamer:
             if self.lyricIndex < len(self.lyrics) - 1:
                 if self.audio_streamer.get_pos() >= self.lyrics[self.lyricIndex+1][0]:
                     self.lyricIndex = self.lyricIndex + 1
@@ -369,8 +463,14 @@ class MainWindow(QWidget):
 
     def on_text_changed(self, text):
         if text:
-            self.timer.start()
+            # Queries seen before are shown right away, only new ones wait for typing to pause
+            if self.suggestions.cached(text) is not None:
+                self.timer.stop()
+                self.show_completer()
+            else:
+                self.timer.start()
         else:
+            self.timer.stop()
             self.completer.popup().hide()
 
     def on_suggestion_selected(self, suggestion):
@@ -386,35 +486,22 @@ class MainWindow(QWidget):
     def show_completer(self):
         text = self.searchBar.text()
         if text:
-            try:
-                suggestion = self.ytm_api.search_videos(text)['items'][:5]
-                suggestion += (self.ytm_api.search_songs(text)['items'][:5])
-            except Exception as e:
-                print(f"Error searching for songs: {e}")
-                self.ytm_api = ytm.YouTubeMusic()
-                suggestion = []
-
-            suggestions = []
-            for song in suggestion:
-                song_name = song.get('name', None)
-                artist_name = song.get('artists', None)
-                if artist_name:
-                    artist_name = artist_name[0].get('name', None)
-
-                if not artist_name:
-                    s = f"{song_name}"
-                else:
-                    s = f"{song_name} - {artist_name}"
-                suggestions.append((s, song.get('videoId', song.get('id', None))))
-            self.model.set_data(suggestions)
-            self.completer.complete()
+            # Returns right away, the suggestions arrive through suggestionsReady
+            self.suggestions.request(text, self.suggestionsReady.emit)
+
+    def on_suggestions_ready(self, text, suggestions):
+        if text != self.searchBar.text():
+            return  # The text changed while the searches ran
+        self.model.set_data(suggestions)
+        self.completer.complete()
 
         
 
 class AutocompleteDelegate(QStyledItemDelegate):
-    def __init__(self, parent=None):
+    def __init__(self, thumbnails, parent=None):
         super().__init__(parent)
-        self.thumbnail_size = QSize(40, 40)
+        self.thumbnails = thumbnails  # ThumbnailService, painting only reads from its cache
+        self.thumbnail_size = thumbnails.size
         self.padding = 5
 
     def paint(self, painter, option, index):
@@ -433,13 +520,12 @@ class AutocompleteDelegate(QStyledItemDelegate):
             self.thumbnail_size.height(),
         )
 
-        # Draw the thumbnail
-        if thumbnail_url:
-            image = iio.imread(thumbnail_url)
-            qimage = QImage(image.data, image.shape[1], image.shape[0], QImage.Format.Format_RGB888)
-            pixmap = QPixmap.fromImage(qimage)
-            painter.drawPixmap(thumbnail_rect, pixmap.scaled(
-                self.thumbnail_size, Qt.AspectRatioMode.KeepAspectRatio, Qt.TransformationMode.SmoothTransformation))
+        # Draw the thumbnail, already scaled, or a placeholder until it has arrived
+        pixmap = self.thumbnails.pixmap(thumbnail_url) if thumbnail_url else None
+        if pixmap is not None:
+            target = QRect(thumbnail_rect.topLeft(), pixmap.size())
+            target.moveCenter(thumbnail_rect.center())
+            painter.drawPixmap(target, pixmap)
         else:
             # Placeholder for missing image
             painter.fillRect(thumbnail_rect, QColor("gray"))
@@ -477,10 +563,8 @@ class AutocompleteModel(QStringListModel):
         if role == Qt.ItemDataRole.DisplayRole:
             return self.suggestions[index.row()][0]
         if role == Qt.ItemDataRole.UserRole:
-            pixmap = QPixmap(self.suggestions[index.row()][1])
-            if pixmap.isNull():
-                return None
-            return pixmap
+            video_id = self.suggestions[index.row()][1]
+            return thumbnail_url(video_id) if video_id else None
         return super().data(index, role)
 
     def set_data(self, suggestions):
@@ -489,17 +573,27 @@ class AutocompleteModel(QStringListModel):
 
 
 def handleClose():
+    if window.loader:
+        window.loader.cancel()
     if window.audio_streamer:
         window.audio_streamer.stop()
     if window.videoTimer:
         window.videoTimer.stop()
+    if window.video:
+        window.video.stop()
     if window.lyricsTimer:
         window.lyricsTimer.stop()
+    window.seekTimer.stop()
+    window.suggestions.close()
+    window.thumbnails.close()
+    window.engine.close()
     app.quit()
 
-app = QApplication(sys.argv)
-mixer.init()
-window = MainWindow()
-window.show()
-app.aboutToQuit.connect(handleClose)
-app.exec()
+# Guarded so separation worker processes can import this module without opening a window
+if __name__ == "__main__":
+    app = QApplication(sys.argv)
+    mixer.init()
+    window = MainWindow()
+    window.show()
+    app.aboutToQuit.connect(handleClose)
+    app.exec()
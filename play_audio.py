@@ -1,238 +1,726 @@
 import os
+import json
 import pyaudio
 import numpy as np
-import soundfile as sf
 import subprocess
 import shutil
 import threading
 import time
 import traceback
-from processing import overlap
+import queue
+from processing import overlap, chunk_length_ms, separate_chunks, AdaptiveChunkSchedule, QualityScheduler
+from separator import Separator
+from separation_pool import SeparationPool
+from tuning import apply_profile
+from chunk_channel import read_chunk
+from stitching import OverlapAddStitcher
+from mixer import StemMixer, pack_stems
+from ring_buffer import RingBuffer
+from chunk_prefetcher import ChunkPrefetcher
+from segment_store import SegmentStore
+from preview import PreviewDecoder
 import sys
+import collections
+
+
+class LookaheadGate:
+    def __init__(self, max_seconds=30.0, max_bytes=None):
+        """
+        Bounds how far separation may run ahead of playback. Producers register
+        every queued chunk and wait for room before producing the next one,
+        the player releases chunks as it finishes them. Chunks are tagged with
+        the seek epoch they were queued for, so a chunk added by a producer that
+        hasn't noticed a seek yet never counts against the new position.
+
+        Args:
+            max_seconds (float): Most audio that may be separated but not yet played.
+            max_bytes (int): Most stem memory that may be queued, unbounded if None.
+        """
+        self.max_seconds = max_seconds
+        self.max_bytes = max_bytes
+        self.pending = collections.deque()  # (epoch, seconds, bytes) of every queued chunk, oldest first
+        self.seconds = 0.0
+        self.bytes = 0
+        self.epoch = 0  # Chunks queued for older seek epochs are dropped
+        self.condition = threading.Condition()
+
+    def add(self, seconds, nbytes, epoch=0):
+        with self.condition:
+            if epoch < self.epoch:
+                return  # Queued for a position that was sought away from, it is never played
+            self.pending.append((epoch, seconds, nbytes))
+            self.seconds += seconds
+            self.bytes += nbytes
+
+    def release(self):
+        """Marks the oldest queued chunk as played."""
+        with self.condition:
+            if self.pending:
+                _, seconds, nbytes = self.pending.popleft()
+                self.seconds -= seconds
+                self.bytes -= nbytes
+            self.condition.notify_all()
+
+    def clear(self, epoch=None):
+        """
+        Forgets queued chunks, e.g. after a seek made them unplayable. With `epoch`,
+        only chunks of older epochs, and ones added for them later are ignored.
+        """
+        with self.condition:
+            if epoch is None:
+                self.pending.clear()
+            else:
+                self.epoch = max(self.epoch, epoch)
+                self.pending = collections.deque(entry for entry in self.pending if entry[0] >= self.epoch)
+            self.seconds = sum(entry[1] for entry in self.pending)
+            self.bytes = sum(entry[2] for entry in self.pending)
+            self.condition.notify_all()
+
+    def has_room(self):
+        if self.max_seconds is not None and self.seconds >= self.max_seconds:
+            return False
+        if self.max_bytes is not None and self.bytes >= self.max_bytes:
+            return False
+        return True
+
+    def room_seconds(self):
+        """
+        Seconds of audio that may still be separated ahead, so a pool can stop dispatching
+        before it would overrun the look-ahead. Byte limits are converted at the rate of
+        the queued chunks.
+        """
+        with self.condition:
+            room = float('inf') if self.max_seconds is None else self.max_seconds - self.seconds
+            if self.max_bytes is not None and self.seconds > 0:
+                room = min(room, (self.max_bytes - self.bytes) * self.seconds / self.bytes)
+            return max(room, 0.0)
+
+    def wait_for_room(self, stop_event):
+        """Blocks while the look-ahead is full, returns False if `stop_event` was set meanwhile."""
+        with self.condition:
+            while not self.has_room():
+                if stop_event.is_set():
+                    return False
+                self.condition.wait(timeout=0.1)
+        return not stop_event.is_set()
+
+
+class SeparationEngine:
+    def __init__(self, model='hdemucs_mmi', workers=1, batch_size=1):
+        """
+        Loads the separator on first use and keeps it, with its worker processes,
+        warm for every song played afterwards.
+
+        Args:
+            model (str): The Demucs model name.
+            workers (int): More than one separates chunks in parallel worker processes.
+            batch_size (int): Chunks stacked into one model call with a single worker.
+        """
+        self.model = model
+        self.workers = workers
+        self.batch_size = batch_size
+        self.separator = None
+        self.lock = threading.Lock()
+
+    def get(self):
+        """The Separator or SeparationPool, loaded on the first call."""
+        with self.lock:
+            if self.separator is None:
+                separator_options = apply_profile(self.model)
+                if self.workers > 1:
+                    self.separator = SeparationPool(self.model, workers=self.workers,
+                                                    separator_options=separator_options)
+                else:
+                    self.separator = Separator(self.model, batch_size=self.batch_size, **separator_options)
+            return self.separator
+
+    def close(self):
+        with self.lock:
+            if isinstance(self.separator, SeparationPool):
+                self.separator.close()
+            self.separator = None
+
+
 class AudioStreamer:
-    def __init__(self, source, root_dir):
+    def __init__(self, source, root_dir, model='hdemucs_mmi', in_memory=False, workers=1, adaptive_chunks=True,
+                 cache=None, lookahead_seconds=30.0, lookahead_mb=None, batch_size=1, crossfade='hann',
+                 ring_ms=250, frames_per_buffer=1024, prefetch_depth=2, seek_buffer_mb=256, preview=True,
+                 adaptive_quality=True, cache_id=None, source_headers=None, engine=None):
         self.tracks = [
             'drums',
             'bass',
             'other',
             "vocals",
         ]
+        self.stems = list(self.tracks)  # Every stem the mixer knows about
+        self.mixer = StemMixer()
         self.source = source
+        self.source_headers = source_headers  # HTTP headers the source URL expects
         self.root_dir = root_dir
+        self.model = model
+        self.in_memory = in_memory  # Separate in this process instead of in the processing subprocess
+        self.workers = workers  # More than one separates chunks in parallel worker processes
+        self.batch_size = batch_size  # Chunks stacked into one model call when a single worker separates
+        self.adaptive_chunks = adaptive_chunks  # Start with a short chunk and grow them
+        # Falls back to cheaper separation settings while separation falls behind playback
+        self.adaptive_quality = adaptive_quality
+        self.quality = QualityScheduler(model, lead_ms=self._lead_ms) if adaptive_quality else None
+        self.cache = cache  # StemCache checked before separating
+        self.cache_id = cache_id  # Identity of the source in the cache, the decoded audio is hashed if None
+        self.cache_key = None  # Key of the cache entry being written, None once there is nothing to write
+        self.cache_writer = None
+        self.degraded = False  # Whether the processing subprocess separated any chunk below the best quality
+        self.crossfade = crossfade  # Fade shape used to stitch overlapping chunks
+        # Separation pauses once this much audio waits to be played
+        self.lookahead = LookaheadGate(lookahead_seconds, lookahead_mb * 1024 * 1024 if lookahead_mb else None)
+        # Separated audio kept for seeking back without separating it again
+        self.segments = SegmentStore(seek_buffer_mb * 1024 * 1024 if seek_buffer_mb else None)
+        self.total_frames = None  # Length of the song once separation reached its end
+        self.separator = None  # Kept across seeks when separating in this process
+        # Shared with the songs played before and after, one of its own is made and closed if None
+        self.owns_engine = engine is None
+        self.engine = engine or SeparationEngine(model, workers, batch_size)
+        # (seek epoch, position in ms), every seek bumps the epoch so work for older ones is dropped
+        self.seek_target = (0, 0)
+        self.chunk_queue = queue.Queue()
+        self.stop_event = threading.Event()
+        # Reads and stacks the next chunks while the current one plays
+        self.prefetcher = ChunkPrefetcher(self.chunk_queue, prefetch_depth, self.stop_event,
+                                          is_stale=lambda epoch: epoch != self.seek_target[0])
+        # Plays the original mix wherever the stems aren't separated yet
+        self.preview = PreviewDecoder(source, headers=source_headers) if preview else None
+        self.preview_frames = 0  # Frames played from the preview instead of stems
+        self.processing_thread = None
         self.p = pyaudio.PyAudio()
         self.stream = None
+        self.ring_ms = ring_ms  # Mixed audio buffered for the output device, also the latency of gain changes
+        self.frames_per_buffer = frames_per_buffer  # Frames the device asks for per callback
+        self.ring = None  # RingBuffer between the mixing thread and the device callback
+        self.callback_buffer = np.zeros((frames_per_buffer, 2), dtype=np.int16)
+        self.producer_done = False  # Set once the mixing thread has written the last frame of the song
+        self.underruns = 0  # Callbacks that found the ring empty before the end of the song
+        # (ring write index, frame of the song, seek epoch) where the frames after the last seek begin
+        self.ring_seek = (0, 0, 0)
         self.i = 0  # Chunk index
         self.playing = threading.Event()
         self.playing.set()  # Start in playing state
-        self.stop_event = threading.Event()
         self.thread = threading.Thread(target=self._stream_audio)
         self.thread.daemon = True  # Ensure thread exits when main program exits
         self.child = None  # To hold the processing subprocess
 
-        # Variables for tracking playback time
-        self.playback_start_time = None  # Time when playback started
-        self.pause_start_time = None  # Time when playback was paused
-        self.total_paused_time = 0.0  # Total time paused
+        # Playback clock, derived from the frames handed to the device
+        self.samplerate = None  # Sample rate of the output stream once it is open
+        self.output_latency = 0.0  # Seconds between handing a frame to the device and hearing it
+        self.frames_played = 0  # Frames handed to the device, only the callback moves it
+        self.clock_epoch = 0  # Seek epoch of the frames the callback hands over
+        # (frames handed before the last callback, time.monotonic() of that callback, frames it handed,
+        # seek epoch). Replaced as a whole so readers never see a torn update and need no lock
+        self.clock = (0, None, 0, 0)
+        self.last_pos = (0, 0.0)  # (seek epoch, position), keeps get_pos monotonic between seeks
         self.lock = threading.Lock()  # Lock for thread-safe operations
+        self.start_time = None  # Time when start() was called
+        self.time_to_first_sound = None  # Seconds from start() until the first frame was written
+        self.first_sound_reported = False  # Printed by the mixing thread, the callback never prints
 
     def start_processing(self):
-        os.makedirs(self.root_dir, exist_ok=True)
-        self.child = subprocess.Popen([sys.executable, "processing.py", self.source])#, stderr=subprocess.PIPE, stdout=subprocess.PIPE)
-
+        self.processing_thread = threading.Thread(target=self._process)
+        self.processing_thread.daemon = True
+        self.processing_thread.start()
+
+    def _process(self):
+        """
+        Produces separated audio for playback from the seek position on, out of the cache,
+        audio separated earlier or fresh separation, and queues it as chunks. Starts over
+        from the new position whenever `seek` is called, until stopped.
+        """
+        try:
+            cached = None
+            if self.cache is not None:
+                self.cache_key = self.cache.key(self.source, self.model, self.cache_params(), audio_id=self.cache_id)
+                cached = self.cache.get(self.cache_key)
+                if cached is not None:
+                    print("Playing separated stems from cache.")
+                    self.cache_key = None  # Nothing left to write
+            while not self.stop_event.is_set():
+                epoch, position_ms = self.seek_target
+                if cached is not None:
+                    self._queue_cached(epoch, position_ms, *cached)
+                else:
+                    self._produce(epoch, position_ms)
+                if self._is_current(epoch):
+                    self.chunk_queue.put((epoch, None))  # End of stream
+                # Stay around for seeks until stopped
+                while self.seek_target[0] == epoch and not self.stop_event.wait(0.1):
+                    pass
+        except Exception as e:
+            print(f"Error while processing audio: {e}")
+            print(traceback.format_exc())
+            self.chunk_queue.put((self.seek_target[0], None))
+        finally:
+            if self.cache_writer is not None:
+                self.cache_writer.abort()  # Never keep a partial song in the cache
+                self.cache_writer = None
+            if self.owns_engine:
+                self.engine.close()
+
+    def _is_current(self, epoch):
+        """Whether work for `epoch` is still wanted, i.e. no seek or stop came in since."""
+        return self.seek_target[0] == epoch and not self.stop_event.is_set()
+
+    def _produce(self, epoch, position_ms):
+        """
+        Queues audio from `position_ms` to the end of the song. Stretches that were
+        separated before are replayed from `self.segments`, separation only runs
+        for the gaps in between.
+        """
+        samplerate = self._samplerate()
+        position = position_ms * samplerate // 1000
+        while self._is_current(epoch):
+            end = self.segments.covered_until(position)
+            for start, names, stacked in self.segments.read(position, end):
+                if not self._is_current(epoch):
+                    return
+                self._queue_stacked(epoch, start, names, stacked, samplerate)
+                if not self.lookahead.wait_for_room(self.stop_event):
+                    return
+            position = end
+            if self.total_frames is not None and position >= self.total_frames:
+                break
+            position = self._separate_from(epoch, position, self.segments.next_start(position))
+            if position is None:
+                break  # Reached the end of the song
+
+        writer = self.cache_writer
+        if writer is not None and self.total_frames is not None and writer.samples == self.total_frames:
+            # Only stems of the best quality go into the cache
+            if self.degraded or (self.quality is not None and self.quality.degraded):
+                print("Not caching the stems, some chunks were separated at reduced quality.")
+                writer.abort()
+            else:
+                writer.commit()
+            self.cache_writer = None
+            self.cache_key = None
+
+    def _separate_from(self, epoch, start, stop=None):
+        """
+        Separates from frame `start` until frame `stop` or the end of the song.
+
+        Returns:
+            int: Frame separation stopped at, None once it reached the end of the song.
+        """
+        samplerate = self._samplerate()
+        if self.in_memory:
+            chunks = self._separate_in_memory(start / samplerate)
+        else:
+            chunks = self._receive_from_child(start / samplerate)
+        stitcher = None
+        position = start
+        try:
+            for i, stems, samplerate, pads in chunks:
+                if stitcher is None:
+                    stitcher = OverlapAddStitcher(overlap * samplerate // 1000, self.crossfade)
+                if not self._is_current(epoch):
+                    # Finished after a seek, kept so seeking back into it doesn't separate it again
+                    names, stacked = self._keep_stems(position, stop, stitcher.push(stems, pads), samplerate)
+                    tail = stitcher.flush()
+                    if tail is not None:
+                        self._keep_stems(position + stacked.shape[1], stop, tail, samplerate)
+                    return position
+                position = self._queue_stems(epoch, position, stop, stitcher.push(stems, pads), samplerate)
+                if stop is not None and position >= stop:
+                    return position  # What follows was separated before
+                # Don't ask for the next chunk until playback has caught up enough
+                if not self.lookahead.wait_for_room(self.stop_event):
+                    return position
+            if stitcher is not None:
+                position = self._queue_stems(epoch, position, stop, stitcher.flush(), samplerate)
+        finally:
+            chunks.close()  # Stops decoding and cancels separation that is no longer needed
+        if stitcher is not None or start == 0:
+            self.total_frames = position  # Not known when the seek went past the end
+        return None
+
+    def _keep_stems(self, position, stop, stems, samplerate):
+        """
+        Packs stitched stems that begin at frame `position` into one int16 (stems, samples, channels)
+        array, cut off at frame `stop`, and keeps them for later seeks.
+
+        Returns:
+            tuple: (stem names, stacked array), the array is empty if nothing was left before `stop`.
+        """
+        names, stacked = pack_stems(stems)
+        if stop is not None:
+            stacked = stacked[:, :max(stop - position, 0)]
+        if stacked.shape[1]:
+            self.segments.add(position, names, stacked, int(self._clock_pos()[1] * samplerate / 1000))
+        return names, stacked
+
+    def _queue_stems(self, epoch, position, stop, stems, samplerate):
+        """
+        Keeps stitched stems that begin at frame `position` for later seeks, see `_keep_stems`,
+        and queues them for playback.
+
+        Returns:
+            int: Frame right after the queued audio.
+        """
+        names, stacked = self._keep_stems(position, stop, stems, samplerate)
+        if stacked.shape[1] == 0:
+            return position
+        self._queue_stacked(epoch, position, names, stacked, samplerate)
+        return position + stacked.shape[1]
+
+    def _queue_stacked(self, epoch, start, names, stacked, samplerate):
+        """Queues audio that begins at frame `start` and appends it to the cache entry if it continues it."""
+        self.lookahead.add(stacked.shape[1] / samplerate, stacked.nbytes, epoch)
+        self.chunk_queue.put((epoch, (start, names, stacked, samplerate)))
+        if self.cache_key is not None and start == (self.cache_writer.samples if self.cache_writer else 0):
+            if self.cache_writer is None:
+                self.cache_writer = self.cache.writer(self.cache_key, names, samplerate, stacked.shape[2])
+            self.cache_writer.append(stacked)
+
+    def _samplerate(self):
+        """Sample rate of the separated audio, loads the separator if it runs in this process."""
+        if self.in_memory:
+            return self._get_separator().samplerate
+        return self.samplerate or 44100  # The processing subprocess resamples to the model rate, 44.1 kHz for Demucs
+
+    def _get_separator(self):
+        """The separator is loaded once and kept across seeks, and across songs with a shared engine."""
+        if self.separator is None:
+            self.separator = self.engine.get()
+        return self.separator
+
+    def _separate_in_memory(self, start_seconds=0.0):
+        """Separates the source in this process, yields (index, stems, sample rate, overlap)."""
+        separator = self._get_separator()
+        schedule = AdaptiveChunkSchedule(lead_ms=self._lead_ms) if self.adaptive_chunks else None
+        for i, stems, pads in separate_chunks(self.source, separator, schedule, start_seconds, self.quality,
+                                              self.source_headers, self.lookahead.room_seconds):
+            yield i, stems, separator.samplerate, pads
+
+    def _receive_from_child(self, start_seconds=0.0):
+        """
+        Runs processing.py as a subprocess and yields (index, stems, sample rate, overlap)
+        for every chunk it pushes through its stdout, as soon as the chunk arrives.
+        """
+        command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "processing.py"),
+                   self.source, "--pipe", "--model", self.model, "--workers", str(self.workers),
+                   "--batch-size", str(self.batch_size), "--start-seconds", f"{start_seconds:.6f}"]
+        if not self.adaptive_chunks:
+            command.append("--fixed-chunks")
+        if self.adaptive_quality:
+            command.append("--adaptive-quality")
+        if self.source_headers:
+            command += ["--headers", json.dumps(self.source_headers)]
+        self.child = subprocess.Popen(command, stdout=subprocess.PIPE)
+        try:
+            while True:
+                chunk = read_chunk(self.child.stdout)
+                if chunk is None:
+                    break
+                i, stems, samplerate, pads, degraded = chunk
+                self.degraded = self.degraded or degraded
+                yield i, stems, samplerate, pads
+        finally:
+            self.child.stdout.close()
+            if self.child.poll() is None:
+                self.child.terminate()  # Stopped early, e.g. after a seek
+            self.child.wait()
 
-    def read_audio_file(self, file_path):
-        """Reads an audio file and returns numpy array and sample rate"""
-        data, samplerate = sf.read(file_path)
-        return data, samplerate
-        
+    def _lead_ms(self):
+        """How much separated audio is ready beyond the playback position, in milliseconds."""
+        samplerate = self.samplerate or 44100
+        position = int(self._clock_pos()[1] * samplerate / 1000)
+        return (self.segments.covered_until(position) - position) * 1000 / samplerate
+
+    def is_cached(self):
+        """Whether the separated stems of the source are already in the cache."""
+        if self.cache is None:
+            return False
+        key = self.cache.key(self.source, self.model, self.cache_params(), audio_id=self.cache_id)
+        return self.cache.get(key) is not None
+
+    def cache_params(self):
+        """Chunking parameters that end up in the stem cache key."""
+        return {'overlap': overlap, 'chunk_length_ms': chunk_length_ms, 'adaptive_chunks': self.adaptive_chunks,
+                'crossfade': self.crossfade}
+
+    def _queue_cached(self, epoch, position_ms, stems, entry):
+        """Queues memory-mapped stems from the cache from `position_ms` on, nothing is read until it is played."""
+        samplerate = entry['samplerate']
+        block = chunk_length_ms * samplerate // 1000
+        for start in range(position_ms * samplerate // 1000, len(stems), block):
+            if not self._is_current(epoch):
+                return
+            part = stems[start:start + block].transpose(1, 0, 2)  # (stems, samples, channels) view
+            self.chunk_queue.put((epoch, (start, entry['sources'], part, samplerate)))
+
+    def _next_chunk(self):
+        """
+        Blocks until the next chunk is ready and returns it as (seek epoch, (start frame,
+        stem names, array of shape (stems, samples, channels), sample rate)), with None
+        instead of the chunk at the end of the song, or None when stopped. Chunks are
+        already stitched and prefetched, so they are played back to back without
+        trimming or reading anything.
+        """
+        return self.prefetcher.get()
 
     def _stream_audio(self):
         print("Streaming audio...")
-        """Internal method to stream audio in a separate thread."""
-        # Wait until the first chunk is available
-        while not (os.path.exists(f"{self.root_dir}/chunk_{self.i}") and len(os.listdir(f"{self.root_dir}/chunk_{self.i}")) == 5):
-            if self.stop_event.is_set():
-                return
-            time.sleep(0.1)
-
-        with self.lock:
-            self.playback_start_time = time.time() + 1
-
+        """
+        Internal method that mixes the queued chunks into the ring buffer in a separate thread.
+        The output device pulls frames from the ring in `_callback`, so a slow
+        mix or a late chunk never blocks the device, it plays silence instead.
+        """
+        epoch = 0
+        position = 0  # Frame of the song the next block written to the ring begins at
+        chunk = None  # Separated chunk being played, (start frame, stem names, stacked stems, sample rate)
+        frame_size = 4096
+        if self.preview is not None:
+            self.preview.start(0)
         while True:
             if self.stop_event.is_set():
                 break
+            if self.time_to_first_sound is not None and not self.first_sound_reported:
+                self.first_sound_reported = True
+                print(f"Time to first sound: {self.time_to_first_sound:.2f} seconds.")
             try:
-                # Handle play/pause
-                while not self.playing.is_set():
-                    with self.lock:
-                        if self.pause_start_time is None:
-                            self.pause_start_time = time.time()
-                    if self.stop_event.is_set():
-                        break
-                    time.sleep(0.1)
-
-                if self.pause_start_time:
-                    with self.lock:
-                        paused_duration = time.time() - self.pause_start_time
-                        self.total_paused_time += paused_duration
-                        self.pause_start_time = None
-
-                # Load and store each track in the tracks list
-                track_data = {}
-                sample_rate = None
-                num_channels = None
-                chunk_path = f"{self.root_dir}/chunk_{self.i}"
-                if not os.path.exists(chunk_path):
-                    # Wait for the chunk to be available
-                    while not os.path.exists(chunk_path):
-                        if self.stop_event.is_set():
-                            break
-                        time.sleep(0.1)
-                for track_file in os.listdir(chunk_path):
-                    track_name = track_file.split('.')[0]
-                    file_path = f"{chunk_path}/{track_file}"
-                    audio_data, sr = self.read_audio_file(file_path)
-                    track_data[track_name] = audio_data
-                    if sample_rate is None:
-                        sample_rate = sr
-                    if num_channels is None:
-                        num_channels = audio_data.shape[1] if len(audio_data.shape) > 1 else 1
-
-                # Clean up chunk directory
-                shutil.rmtree(chunk_path)
-
-                # Prepare for frame playback
-                num_samples = next(iter(track_data.values())).shape[0]
-                frame_size = 1024
-
-                # Calculate 100 ms in samples
-                samples_to_skip = int(((overlap + 25) / 1000) * sample_rate)  # 100 ms of samples to skip at the start and end
-
-                if self.stream is None:
-                    self.stream = self.p.open(format=self.p.get_format_from_width(2),  # Assuming 16-bit audio
-                                            channels=num_channels,
-                                            rate=sample_rate,
-                                            output=True)
-
-                # Adjust loop to skip 100 ms at the beginning and the end
-                start_sample = samples_to_skip
-                end_sample = num_samples - samples_to_skip
-
-                for start_idx in range(start_sample, end_sample, frame_size):
-                    end_idx = min(start_idx + frame_size, end_sample)
-                    with self.lock:
-                        current_tracks = self.tracks.copy()  # Copy current tracks
-                    # Combine the audio data for current frame
-                    frame = None
-                    for track in current_tracks:
-                        if track in track_data:
-                            track_frame = track_data[track][start_idx:end_idx]
-                            if frame is None:
-                                frame = track_frame.copy()
-                            else:
-                                frame += track_frame
-                    if frame is None:
-                        # If no tracks are selected, play silence
-                        frame = np.zeros((end_idx - start_idx, num_channels))
-
-                    gain_reduction = 0.8  # Reduce volume by 20%
-                    frame *= gain_reduction
-
-                    # Convert frame to int16
-                    frame_int16 = (frame * 32767).astype(np.int16)
-
-                    # Handle play/pause as before
-                    while not self.playing.is_set():
-                        with self.lock:
-                            if self.pause_start_time is None:
-                                self.pause_start_time = time.time()
+                if self.seek_target[0] != epoch:
+                    # Drop whatever the device hasn't played yet, playback goes on at the seek position
+                    epoch, position_ms = self.seek_target
+                    position = position_ms * (self.samplerate or 44100) // 1000
+                    chunk = None
+                    self.producer_done = False
+                    self._restart_ring(position, epoch)
+                    if self.preview is not None:
+                        self.preview.start(position)
+
+                if chunk is None:
+                    # Without a preview there is nothing else to play, so wait for the chunk
+                    item = self.prefetcher.get(timeout=0 if self.preview is not None else None)
+                    if item is None:
                         if self.stop_event.is_set():
                             break
-                        time.sleep(0.01)  # Smaller sleep for more responsive pause
-
-                    if self.stop_event.is_set():
-                        break
-
-                    if self.pause_start_time:
-                        with self.lock:
-                            paused_duration = time.time() - self.pause_start_time
-                            self.total_paused_time += paused_duration
-                            self.pause_start_time = None
-
-                    # Convert frame to bytes
-                    frame_bytes = frame_int16.tobytes()
-                    # Play the frame
-                    self.stream.write(frame_bytes)
-
-                with self.lock:
-                    # If playback was paused during the chunk, adjust the playback_start_time
-                    if self.pause_start_time:
-                        paused_duration = time.time() - self.pause_start_time
-                        self.total_paused_time += paused_duration
-                        self.pause_start_time = None
-                    self.i += 1
+                        position += self._play_preview(position, frame_size, epoch)
+                        continue
+                    chunk_epoch, chunk = item
+                    if chunk_epoch != epoch:
+                        chunk = None  # Queued before a seek
+                        continue
+                    if chunk is None:
+                        self.producer_done = True  # End of the song
+                        continue
+                    if chunk[0] + chunk[2].shape[1] <= position:
+                        # The preview already played all of it
+                        chunk = None
+                        self._finish_chunk(epoch)
+                        continue
+
+                start, names, stacked, sample_rate = chunk  # stacked is (stems, samples, channels)
+                self._open_stream(sample_rate, stacked.shape[2], frame_size)
+                # Continue at the very frame the preview stopped at, if it played the start of the chunk
+                offset = max(position - start, 0)
+                # Mix the block in one pass, gain changes ramp in within the block
+                frame_int16 = self.mixer.mix(stacked[:, offset:offset + frame_size], names)
+                if not self._write_to_ring(frame_int16, epoch):
+                    continue
+                position = start + offset + len(frame_int16)
+                if self.preview is not None:
+                    self.preview.advance(position)  # Keeps the preview decoding just ahead of the stems
+                if position >= start + stacked.shape[1]:
+                    chunk = None
+                    self._finish_chunk(epoch)
             except FileNotFoundError:
                 break
             except Exception as e:
                 print(f"Error while streaming audio: {e}")
                 print(traceback.format_exc())
                 break
-        # Stop and close the stream
+        if self.preview is not None:
+            self.preview.close()
         if self.stream is not None:
             self.stream.stop_stream()
             self.stream.close()
         self.p.terminate()
 
-
+    def _finish_chunk(self, epoch):
+        if self._is_current(epoch):
+            with self.lock:
+                self.i += 1
+            self.lookahead.release()  # Lets separation continue if it was waiting for playback
+
+    def _play_preview(self, position, frames, epoch):
+        """
+        Writes up to `frames` of the unseparated source from frame `position` on to the ring,
+        while the separated chunk for that position isn't ready.
+
+        Returns:
+            int: Number of frames written.
+        """
+        block = self.preview.read(position, frames)
+        if block is None:
+            time.sleep(0.005)  # Neither stems nor the preview are there yet
+            return 0
+        if len(block) == 0:
+            self.producer_done = True  # Played the preview to the end of the song
+            time.sleep(0.005)
+            return 0
+        self._open_stream(self.preview.samplerate, self.preview.channels, frames)
+        if self.preview_frames == 0:
+            print("Playing the original mix until the stems are ready.")
+        frame_int16 = self.mixer.mix(block[None], ['original'])
+        if not self._write_to_ring(frame_int16, epoch):
+            return 0
+        self.preview_frames += len(block)
+        return len(block)
+
+    def _open_stream(self, sample_rate, num_channels, frame_size):
+        if self.stream is not None:
+            return
+        self.ring = RingBuffer(max(self.ring_ms * sample_rate // 1000, 2 * frame_size), num_channels)
+        self.samplerate = sample_rate
+        self.stream = self.p.open(format=self.p.get_format_from_width(2),  # Assuming 16-bit audio
+                                  channels=num_channels,
+                                  rate=sample_rate,
+                                  output=True,
+                                  frames_per_buffer=self.frames_per_buffer,
+                                  stream_callback=self._callback)
+        self.output_latency = self.stream.get_output_latency()
+
+    def _restart_ring(self, start, epoch):
+        """Drops the frames still in the ring and tells the callback the next ones begin at frame `start`."""
+        write_index = self.ring.write_index if self.ring is not None else 0
+        # Published before the ring is cleared, so the callback knows where the new frames begin
+        self.ring_seek = (write_index, start, epoch)
+        if self.ring is not None:
+            self.ring.clear()
+
+    def _write_to_ring(self, frames, epoch):
+        """Blocks until all of `frames` is in the ring, returns False if stopped or seeking meanwhile."""
+        written = 0
+        while written < len(frames):
+            if not self._is_current(epoch):
+                return False
+            count = self.ring.write(frames[written:])
+            written += count
+            if count == 0:
+                time.sleep(0.005)  # The ring is full, the device drains a few milliseconds at a time
+        return True
+
+    def _callback(self, in_data, frame_count, time_info, status):
+        """
+        Runs on the audio device's thread whenever it needs `frame_count` more
+        frames. Only copies from the ring into a reused buffer, it never waits
+        or takes a lock. The one allocation per block is the bytes object
+        handed back, PyAudio takes nothing but bytes and keeps no reference.
+        """
+        if self.stop_event.is_set():
+            return (None, pyaudio.paComplete)
+        if len(self.callback_buffer) < frame_count or self.callback_buffer.shape[1] != self.ring.channels:
+            self.callback_buffer = np.zeros((frame_count, self.ring.channels), dtype=np.int16)
+        out = self.callback_buffer[:frame_count]
+        if not self.playing.is_set():
+            out[:] = 0  # Paused: keep the device fed with silence without consuming the ring
+            self.clock = (self.frames_played, time.monotonic(), 0, self.clock_epoch)
+            return (out.tobytes(), pyaudio.paContinue)
+
+        count = self.ring.read_into(out)
+        clear_index, start, epoch = self.ring_seek
+        if epoch != self.clock_epoch and self.ring.read_index >= clear_index:
+            # The frames just read come after a seek, the clock continues from the seek position
+            self.frames_played = start + max(self.ring.read_index - count - clear_index, 0)
+            self.clock_epoch = epoch
+        self.clock = (self.frames_played, time.monotonic(), count, self.clock_epoch)
+        self.frames_played += count
+        if count < frame_count:
+            out[count:] = 0
+            if not self.producer_done:
+                self.underruns += 1  # The mixer fell behind the device
+        if count and self.time_to_first_sound is None:
+            self.time_to_first_sound = time.time() - self.start_time
+        return (out.tobytes(), pyaudio.paContinue)
 
     def change_tracks(self, tracks):
         """Change the tracks to be streamed."""
         self.tracks = tracks
+        self.mixer.set_gains({name: 1.0 if name in tracks else 0.0 for name in self.stems})
+
+    def set_volumes(self, volumes):
+        """Sets the volume of stems, e.g. {'vocals': 0.2}, 1 is the original level."""
+        self.mixer.set_gains(volumes)
+
+    def _clock_pos(self):
+        """
+        Returns (seek epoch, audible position in milliseconds) straight from the clock,
+        not clamped, for internal use where a slight step back does no harm.
+
+        Counts the frames handed to the device, interpolates within the last
+        callback's buffer and subtracts the device's output latency. Takes no lock.
+        """
+        frames, stamp, handed, epoch = self.clock
+        seek_epoch, seek_ms = self.seek_target
+        if epoch != seek_epoch:
+            return seek_epoch, float(seek_ms)  # Nothing from after the latest seek has been played yet
+        if stamp is None:
+            return epoch, 0.0
+        # The device plays the last callback's frames in real time, it never gets ahead of them
+        frames += min(handed, (time.monotonic() - stamp) * self.samplerate)
+        return epoch, max((frames / self.samplerate - self.output_latency) * 1000.0, 0.0)
 
     def get_pos(self):
-        """Returns the current playback position in milliseconds."""
+        """
+        Returns the audible playback position in milliseconds, the clock the GUI
+        and the video follow. Only goes backwards on a seek: the high-water mark
+        is read and moved under the same lock `seek` resets it under, so callers
+        on any thread never see it step back.
+        """
         with self.lock:
-            if self.playback_start_time is None:
-                return 0.0
-            current_time = time.time()
-            if self.playing.is_set():
-                elapsed_time = current_time - self.playback_start_time - self.total_paused_time
-            else:
-                # If paused, don't include the current paused duration
-                elapsed_time = self.pause_start_time - self.playback_start_time - self.total_paused_time
-            position_ms = elapsed_time * 1000.0
-        return max(0.0, position_ms)
+            epoch, position_ms = self._clock_pos()
+            last_epoch, last_pos = self.last_pos
+            if last_epoch == epoch:
+                position_ms = max(last_pos, position_ms)
+            self.last_pos = (epoch, position_ms)
+            return position_ms
+
+    def seek(self, position_ms):
+        """
+        Moves playback to `position_ms`. Audio separated before is replayed from memory
+        or the cache, separation restarts at the first audio that is missing, and
+        chunks queued or being separated for the old position are dropped.
+        """
+        position_ms = max(int(position_ms), 0)
+        with self.lock:
+            epoch = self.seek_target[0] + 1
+            self.last_pos = (epoch, float(position_ms))
+            self.seek_target = (epoch, position_ms)
+        self.lookahead.clear(epoch)  # Wakes separation up if it waits for playback, so it sees the seek
+        print(f"Seeking to {position_ms / 1000:.1f} s.")
 
     def play(self):
         """Resume playback."""
-        with self.lock:
-            if not self.playing.is_set():
-                self.playing.set()
-                if self.pause_start_time:
-                    paused_duration = time.time() - self.pause_start_time
-                    self.total_paused_time += paused_duration
-                    self.pause_start_time = None
+        self.playing.set()
 
     def pause(self):
-        """Pause playback."""
-        with self.lock:
-            if self.playing.is_set():
-                self.playing.clear()
-                self.pause_start_time = time.time()
+        """Pause playback, the device plays silence and the clock stands still."""
+        self.playing.clear()
 
     def start(self):
         """Start processing and streaming."""
+        self.start_time = time.time()
         self.start_processing()
+        self.prefetcher.start()
         self.thread.start()
 
     def stop(self):
         """Stop processing and streaming."""
         self.stop_event.set()
         self.thread.join()
+        if self.underruns:
+            print(f"Output underruns: {self.underruns}")
         if self.child is not None:
             self.child.terminate()
             self.child.wait()
-        shutil.rmtree(self.root_dir)
+        shutil.rmtree(self.root_dir, ignore_errors=True)
         self.p.terminate()
 
     def handle_signal(self, signum, frame):
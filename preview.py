@@ -0,0 +1,105 @@
+import collections
+import threading
+import time
+import numpy as np
+from audio_reader import PCMStreamReader
+
+
+class PreviewDecoder:
+    def __init__(self, source, samplerate=44100, channels=2, ahead_seconds=10.0, block_frames=4096, headers=None):
+        """
+        Decodes the unseparated source on a worker thread so playback can start
+        right away and fill in wherever separated stems aren't ready yet.
+
+        Args:
+            source (str): Path or URL of the audio.
+            samplerate (int): Sample rate to decode at, the rate the stems come at.
+            channels (int): Number of channels to decode to.
+            ahead_seconds (float): How far decoding may run ahead of the last read.
+            block_frames (int): Frames decoded per read from ffmpeg.
+            headers (dict): HTTP headers sent along when the source is a URL.
+        """
+        self.source = source
+        self.samplerate = samplerate
+        self.channels = channels
+        self.ahead_frames = int(ahead_seconds * samplerate)
+        self.block_frames = block_frames
+        self.headers = headers
+        self.blocks = collections.deque()  # (start frame, int16 array of shape (frames, channels))
+        self.end = None  # Frame the source ends at, once decoding got there
+        self.position = 0  # Frame playback is at, decoding runs at most `ahead_seconds` past it
+        self.lock = threading.Lock()
+        self.run_stop = None  # Stops the decoding run in progress
+        self.thread = None
+
+    def start(self, start_frame=0):
+        """(Re)starts decoding at `start_frame`, dropping everything decoded before."""
+        self.close()
+        with self.lock:
+            self.blocks.clear()
+            self.end = None
+            self.position = start_frame
+        self.run_stop = threading.Event()
+        self.thread = threading.Thread(target=self._run, args=(start_frame, self.run_stop))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def close(self):
+        if self.run_stop is not None:
+            self.run_stop.set()
+            self.thread.join()
+            self.run_stop = None
+
+    def _run(self, start_frame, run_stop):
+        try:
+            with PCMStreamReader(self.source, self.samplerate, self.channels, start_frame / self.samplerate,
+                                 self.headers) as reader:
+                decoded = start_frame
+                while not run_stop.is_set():
+                    if decoded - self.position > self.ahead_frames:
+                        time.sleep(0.05)
+                        continue
+                    block = reader.read(self.block_frames)
+                    if len(block) == 0:
+                        break
+                    # The reader scaled int16 by 1/32768, scaling back is exact
+                    block = (block * 32768).astype(np.int16)
+                    with self.lock:
+                        self.blocks.append((decoded, block))
+                    decoded += len(block)
+                if not run_stop.is_set():
+                    with self.lock:
+                        self.end = decoded
+        except Exception as e:
+            print(f"Error while decoding the preview: {e}")
+
+    def _advance(self, position):
+        self.position = position
+        while self.blocks and self.blocks[0][0] + len(self.blocks[0][1]) <= position:
+            self.blocks.popleft()
+
+    def advance(self, position):
+        """
+        Tells the decoder playback reached frame `position` without reading, while
+        stems are played. Decoding keeps following, so the preview is ready to
+        fill in right where stems run out, and blocks behind it are dropped.
+        """
+        with self.lock:
+            self._advance(position)
+
+    def read(self, position, frames):
+        """
+        Returns decoded audio from frame `position` on, at most `frames` long.
+
+        Returns:
+            np.ndarray: int16 array of shape (frames, channels), empty at the end of the
+                        source, or None if that part hasn't been decoded yet.
+        """
+        with self.lock:
+            self._advance(position)
+            if self.blocks and self.blocks[0][0] <= position:
+                start, block = self.blocks[0]
+                return block[position - start:position - start + frames]
+            if self.end is not None and position >= self.end:
+                return np.zeros((0, self.channels), dtype=np.int16)
+            return None
@@ -1,87 +1,334 @@
 import os
-from pydub import AudioSegment
 import time
 import sys
-import demucs.separate
-import math
+import json
+import argparse
+import torch
+from demucs.audio import save_audio
+from audio_reader import PCMStreamReader
+from separator import Separator
+from separation_pool import SeparationPool
+from chunk_channel import write_chunk, write_end
+from tuning import apply_profile
 
-overlap = 100 # amount of overlap at front and back
+overlap = 50 # amount of overlap at front and back, crossfaded over twice this length when stitching
+chunk_length_ms = 10 * 1000
 
-def process_audio_sync(filepath, model='hdemucs_mmi'):
+# Ways to separate, from best to cheapest, QualityScheduler walks down them when separation falls behind.
+# None keeps what the separator was created with, for the model that is the model that was asked for
+quality_tiers = [
+    {'model': None, 'shifts': None, 'overlap': None, 'segment': None},
+    {'model': None, 'shifts': 0, 'overlap': 0.1, 'segment': None},
+    {'model': None, 'shifts': 0, 'overlap': 0.0, 'segment': None},
+]
+# Single models with the same sources as a bag of models, roughly four times faster
+lighter_models = {
+    'htdemucs_ft': 'htdemucs',
+    'mdx': 'hdemucs_mmi',
+    'mdx_extra': 'hdemucs_mmi',
+    'mdx_q': 'hdemucs_mmi',
+    'mdx_extra_q': 'hdemucs_mmi',
+}
+
+class AdaptiveChunkSchedule:
+    def __init__(self, first_ms=2500, max_ms=20000, growth=2.0, safety=0.5, lead_ms=None):
+        """
+        Picks the length of every next chunk. Starts small so the first chunk is
+        ready quickly, then grows towards `max_ms` while the separated audio is
+        far enough ahead of playback to afford a larger (more efficient) chunk.
+
+        Args:
+            first_ms (int): Length of the first chunk, also the smallest chunk.
+            max_ms (int): Largest chunk length.
+            growth (float): Largest factor between consecutive chunk lengths.
+            safety (float): Fraction of the current lead a chunk may take to separate.
+            lead_ms (callable): Returns the current lead in milliseconds. Estimated from the
+                audio separated since the first chunk if omitted, assuming playback started then.
+        """
+        self.first_ms = first_ms
+        self.max_ms = max_ms
+        self.growth = growth
+        self.safety = safety
+        self.last_ms = None
+        self.rtf = None  # Seconds of separation per second of audio
+        self.produced_ms = 0
+        self.playback_start_time = None  # Playback is assumed to start with the first chunk
+        self.lead_ms = lead_ms or self._estimated_lead_ms
+
+    def _estimated_lead_ms(self):
+        """How much separated audio is ready beyond the estimated playback position."""
+        if self.playback_start_time is None:
+            return 0
+        return self.produced_ms - (time.time() - self.playback_start_time) * 1000
+
+    def next_length(self):
+        if self.last_ms is None or self.rtf is None:
+            length = self.first_ms
+        else:
+            # The next chunk has to be separated before the lead runs out
+            affordable = self.safety * self.lead_ms() / max(self.rtf, 1e-3)
+            length = min(self.last_ms * self.growth, affordable)
+        self.last_ms = int(min(max(length, self.first_ms), self.max_ms))
+        return self.last_ms
+
+    def record(self, length_ms, elapsed):
+        """Registers a delivered chunk and how long it took to separate."""
+        if self.playback_start_time is None:
+            self.playback_start_time = time.time()
+        rtf = elapsed * 1000 / max(length_ms, 1)
+        self.rtf = rtf if self.rtf is None else 0.7 * self.rtf + 0.3 * rtf
+        self.produced_ms += length_ms
+
+class QualityScheduler:
+    def __init__(self, model='hdemucs_mmi', tiers=None, low_lead_ms=5000, high_lead_ms=20000, max_rtf=0.9,
+                 cooldown=2, lead_ms=None):
+        """
+        Picks how expensive the separation of the next chunk may be. Measures the
+        real-time factor (RTF) of every chunk and the lead of separation over
+        playback. Drops to the next cheaper tier when the lead runs low while
+        separation is slower than `max_rtf`, and climbs back once the lead is
+        comfortable again and the better tier keeps up with real time.
+
+        Args:
+            model (str): The Demucs model asked for, used by the best tier.
+            tiers (list): Separator.configure arguments from best to cheapest, see `quality_tiers`.
+            low_lead_ms (int): Lead below which quality drops.
+            high_lead_ms (int): Lead above which quality climbs back.
+            max_rtf (float): RTF a tier may have before it counts as too slow.
+            cooldown (int): Chunks separated on a tier before it may switch again.
+            lead_ms (callable): Returns the current lead in milliseconds. Estimated from the
+                audio separated since the first chunk if omitted, assuming playback started then.
+        """
+        self.model = model
+        if tiers is None:
+            tiers = list(quality_tiers)
+            if model in lighter_models:
+                tiers.append({'model': lighter_models[model], 'shifts': 0, 'overlap': 0.1, 'segment': None})
+        self.tiers = tiers
+        self.low_lead_ms = low_lead_ms
+        self.high_lead_ms = high_lead_ms
+        self.max_rtf = max_rtf
+        self.cooldown = cooldown
+        self.lead_ms = lead_ms or self._estimated_lead_ms
+        self.level = 0  # Index of the tier in use
+        self.rtf = {}  # Tier index -> smoothed RTF measured on it
+        self.since_switch = 0
+        self.degraded = False  # Whether any chunk was separated below the best tier
+        self.switches = []  # (time, from tier, to tier, reason) of every switch
+        self.produced_ms = 0
+        self.first_chunk_time = None
+
+    def config(self):
+        """Separator.configure arguments for the next chunk."""
+        tier = dict(self.tiers[self.level])
+        tier['model'] = tier['model'] or self.model
+        return tier
+
+    def _estimated_lead_ms(self):
+        if self.first_chunk_time is None:
+            return 0
+        return self.produced_ms - (time.time() - self.first_chunk_time) * 1000
+
+    def record(self, length_ms, elapsed):
+        """
+        Registers a separated chunk and how long it took.
+
+        Returns:
+            bool: Whether the next chunk is separated on a different tier.
+        """
+        if self.first_chunk_time is None:
+            self.first_chunk_time = time.time()
+        self.produced_ms += length_ms
+        self.degraded = self.degraded or self.level > 0
+        rtf = elapsed * 1000 / max(length_ms, 1)
+        previous = self.rtf.get(self.level)
+        self.rtf[self.level] = rtf if previous is None else 0.7 * previous + 0.3 * rtf
+        self.since_switch += 1
+        if self.since_switch < self.cooldown:
+            return False
+
+        lead = self.lead_ms()
+        rtf = self.rtf[self.level]
+        if lead < self.low_lead_ms and rtf > self.max_rtf and self.level < len(self.tiers) - 1:
+            return self._switch(self.level + 1, f"lead {lead / 1000:.1f} s is below {self.low_lead_ms / 1000:.1f} s "
+                                                f"at RTF {rtf:.2f}")
+        better = self.rtf.get(self.level - 1)
+        # A better tier that was too slow gets another try after a while, the load may have changed
+        retry = self.since_switch >= 10 * self.cooldown
+        if self.level > 0 and lead > self.high_lead_ms and (better is None or better < 1.0 or retry):
+            reason = f"lead {lead / 1000:.1f} s is above {self.high_lead_ms / 1000:.1f} s"
+            if better is not None:
+                reason += f", RTF there was {better:.2f}"
+            return self._switch(self.level - 1, reason)
+        return False
+
+    def _switch(self, level, reason):
+        self.switches.append((time.time(), self.level, level, reason))
+        direction = "down" if level > self.level else "up"
+        self.level = level
+        self.since_switch = 0
+        settings = ", ".join(f"{name} {value}" for name, value in self.config().items() if value is not None)
+        print(f"Separation quality {direction} to tier {level} ({settings}): {reason}.")
+        return True
+
+def process_audio_sync(filepath, model='hdemucs_mmi', separator=None, separator_options=None):
     """
     Processes an audio file by splitting it into chunks, applying Demucs separation,
     and storing the outputs in a designated directory.
 
     Args:
-        filepath (str): The path to the input MP3 file.
+        filepath (str): The path to the input audio file.
         model (str): The Demucs model name to use for separation.
+        separator (Separator): An already loaded separator to reuse, one is created if omitted.
+        separator_options (dict): Further arguments for the separator created here.
     """
     if not os.path.isfile(filepath):
         print(f"Error: File '{filepath}' does not exist.")
         return
 
-    try:
-        # Load the audio file
-        audio = AudioSegment.from_mp3(filepath)
-        print(f"Loaded audio file '{filepath}' successfully.")
-    except Exception as e:
-        print(f"Failed to load audio file '{filepath}': {e}")
-        return
+    # Load the model once, every chunk below reuses it
+    if separator is None:
+        separator = Separator(model, **(separator_options or {}))
 
-        # Load audio file
-    audio = AudioSegment.from_file(filepath)
-    
-    # Convert chunk length from seconds to milliseconds
-    chunk_length_ms = 10 * 1000
-    total_chunks = math.ceil(len(audio) / chunk_length_ms)
+    with PCMStreamReader(filepath, separator.samplerate, separator.audio_channels) as reader:
+        for i, window in reader.windows(chunk_length_ms, overlap):
+            start_time = time.time()
 
+            # Keep the original next to the stems, it is moved in last to mark the chunk complete
+            chunk_file = f"chunk_{i}.mp3"
+            wav = torch.from_numpy(window.T.copy())
+            save_audio(wav, chunk_file, separator.samplerate)
+            print(f"Exported chunk {i} with {len(window)} samples.")
 
-    for i in range(total_chunks):
-        
-        start = i * chunk_length_ms
-        if i != 0:
-            start -= overlap
-        end = min((i + 1) * chunk_length_ms + overlap, len(audio))  # Avoid exceeding the length
+            # Define output path
+            output_chunk_dir = os.path.join(f'temp/{model}', f"chunk_{i}")
+            os.makedirs(output_chunk_dir, exist_ok=True)
+            output_path = os.path.join(output_chunk_dir, "original.mp3")
 
-        chunk = audio[start:end]
-        chunk.export(f"chunk_{i}.mp3", format="mp3")
-        print(f"Exported chunk {i} from {start}ms to {end}ms.")
+            # Apply Demucs separation
+            try:
+                sources = separator.separate(wav)
+                for source, name in zip(sources, separator.sources):
+                    save_audio(source, os.path.join(output_chunk_dir, f"{name}.mp3"), separator.samplerate)
+                print(f"Applied Demucs separation on '{chunk_file}'.")
+            except Exception as e:
+                print(f"Demucs separation failed for chunk {i}: {e}")
+                os.remove(chunk_file)  # Clean up the failed chunk file
+                continue
 
-        start_time = time.time()
+            # Move chunk to output path
+            os.rename(chunk_file, output_path)
 
-        chunk_file = f"chunk_{i}.mp3"
+            elapsed_time = time.time() - start_time
+            print(f"Chunk {i} processed in {elapsed_time:.2f} seconds.")
+            print(f"Output Path: {output_path}\n")
 
-        # Apply Demucs separation
-        try:
-            demucs.separate.main(["--mp3", "-o", "temp", "-n", model, chunk_file])
-            print(f"Applied Demucs separation on '{chunk_file}'.")
-        except Exception as e:
-            print(f"Demucs separation failed for chunk {i}: {e}")
-            os.remove(chunk_file)  # Clean up the failed chunk file
-            continue
+def separate_chunks(filepath, separator, schedule=None, start_seconds=0.0, quality=None, headers=None, room=None):
+    """
+    Separates an audio file chunk by chunk entirely in memory. The source is
+    stream-decoded by ffmpeg and every window goes straight into the separator
+    as a tensor, no chunk or stem is ever encoded or written to disk.
+
+    Args:
+        filepath (str): The path to the input audio file.
+        separator (Separator or SeparationPool): The engine to separate with.
+        schedule (AdaptiveChunkSchedule): Picks variable chunk lengths, chunks are
+            `chunk_length_ms` long if omitted.
+        start_seconds (float): Position in the file separation starts at, the first
+            chunk begins exactly there.
+        quality (QualityScheduler): Picks cheaper settings while separation can't keep up,
+            chunks are separated as configured if omitted. The settings are passed along with
+            every batch, the separator itself isn't reconfigured.
+        headers (dict): HTTP headers sent along when `filepath` is a URL.
+        room (callable): Returns the seconds of audio that may still be separated ahead of
+            playback, keeps the separator from working further ahead, unbounded if omitted.
 
-        # Define output path
-        output_chunk_dir = os.path.join(f'temp/{model}', f"chunk_{i}")
-        os.makedirs(output_chunk_dir, exist_ok=True)
-        output_path = os.path.join(output_chunk_dir, "original.mp3")
+    Yields:
+        tuple: (chunk index, dict mapping stem name to a float32 array of shape (samples, channels),
+                (samples of overlap before, samples of overlap after))
+    """
+    hop_ms = schedule.next_length if schedule is not None else chunk_length_ms
+    config = quality.config if quality is not None else None
+    timings = {}  # Chunk index -> its share of the batch it was separated in, if separated in one
+    with PCMStreamReader(filepath, separator.samplerate, separator.audio_channels, start_seconds, headers) as reader:
+        start_time = time.time()
+        for i, stems in separator.separate_windows(reader.windows(hop_ms, overlap), config, room, timings):
+            # Between deliveries every chunk of a batch but the first would look free
+            elapsed_time = timings.pop(i, time.time() - start_time)
+            pads = reader.pads.pop(i)
+            length_ms = (len(next(iter(stems.values()))) - sum(pads)) * 1000 // separator.samplerate
+            if schedule is not None:
+                schedule.record(length_ms, elapsed_time)
+            if quality is not None:
+                quality.record(length_ms, elapsed_time)
+            print(f"Chunk {i} ({length_ms} ms) separated in memory in {elapsed_time:.2f} seconds.")
+            yield i, stems, pads
+            start_time = time.time()
 
-        # Move chunk to output path
-        os.rename(chunk_file, output_path)
+def stream_chunks(filepath, out, model='hdemucs_mmi', workers=1, adaptive_chunks=True, batch_size=1,
+                  start_seconds=0.0, adaptive_quality=False, separator_options=None, headers=None):
+    """
+    Separates an audio file in memory and pushes every finished chunk to `out`
+    as a frame of the chunk channel protocol, followed by an end frame.
 
-        elapsed_time = time.time() - start_time
-        print(f"Chunk {i} processed in {elapsed_time:.2f} seconds.")
-        print(f"Output Path: {output_path}\n")
+    Args:
+        filepath (str): The path to the input audio file.
+        out: Binary file object the frames are written to.
+        model (str): The Demucs model name to use for separation.
+        workers (int): Number of separation worker processes.
+        adaptive_chunks (bool): Whether to grow chunk lengths with AdaptiveChunkSchedule.
+        batch_size (int): Most chunks stacked into one model call with a single worker.
+        start_seconds (float): Position in the file separation starts at.
+        adaptive_quality (bool): Whether to fall back to cheaper settings with QualityScheduler.
+        separator_options (dict): Further Separator arguments, e.g. from `tuning.apply_profile`.
+        headers (dict): HTTP headers sent along when `filepath` is a URL.
+    """
+    separator_options = separator_options or {}
+    if workers > 1:
+        separator = SeparationPool(model, workers=workers, separator_options=separator_options)
+    else:
+        separator = Separator(model, batch_size=batch_size, **separator_options)
+    try:
+        schedule = AdaptiveChunkSchedule() if adaptive_chunks else None
+        quality = QualityScheduler(model) if adaptive_quality else None
+        for i, stems, pads in separate_chunks(filepath, separator, schedule, start_seconds, quality, headers):
+            write_chunk(out, i, stems, separator.samplerate, pads, quality is not None and quality.degraded)
+        write_end(out)
+    finally:
+        if isinstance(separator, SeparationPool):
+            separator.close()
 
 if __name__ == "__main__":
-    # take in the source audio file
-    if len(sys.argv) < 2:
-        print("Usage: python processing.py <path_to_audio_file>")
+    parser = argparse.ArgumentParser(description="Separate an audio file into stems chunk by chunk")
+    parser.add_argument("audio_file_path")
+    parser.add_argument("--model", default="hdemucs_mmi")
+    parser.add_argument("--pipe", action="store_true",
+                        help="write separated chunks to stdout as frames instead of MP3 files to temp/")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--fixed-chunks", action="store_true", help="disable adaptive chunk lengths")
+    parser.add_argument("--batch-size", type=int, default=1, help="chunks separated together in one model call")
+    parser.add_argument("--start-seconds", type=float, default=0.0, help="position separation starts at (--pipe)")
+    parser.add_argument("--adaptive-quality", action="store_true",
+                        help="switch to cheaper separation settings while separation falls behind (--pipe)")
+    parser.add_argument("--no-profile", action="store_true", help="ignore the CPU profile written by tuning.py")
+    parser.add_argument("--headers", default=None, help="JSON object of HTTP headers for a stream URL (--pipe)")
+    args = parser.parse_args()
+    separator_options = {} if args.no_profile else apply_profile(args.model)
+
+    if args.pipe:
+        # stdout carries the frames, everything printed goes to stderr instead
+        channel = sys.stdout.buffer
+        sys.stdout = sys.stderr
+        try:
+            stream_chunks(args.audio_file_path, channel, args.model, args.workers, not args.fixed_chunks,
+                          args.batch_size, args.start_seconds, args.adaptive_quality, separator_options,
+                          json.loads(args.headers) if args.headers else None)
+        except BrokenPipeError:
+            pass  # The player went away
     else:
-        audio_file_path = sys.argv[1]
-        process_audio_sync(audio_file_path)
+        process_audio_sync(args.audio_file_path, args.model, separator_options=separator_options)
 
 # # testing code
 # if __name__ == "__main__":
 #     path = 'testing_files/lYBUbBu4W08.mp3'
 #     process_audio_sync(path)
-
@@ -0,0 +1,73 @@
+import numpy as np
+
+
+class RingBuffer:
+    def __init__(self, capacity, channels, dtype=np.int16):
+        """
+        Preallocated single-producer single-consumer ring of audio frames.
+
+        No lock is taken: only the producer moves `write_index` and only the
+        consumer moves `read_index`, and each side publishes its index after
+        the frames are copied, so the other side never sees a half-copied
+        region. Both indices count frames since creation and only grow.
+
+        Args:
+            capacity (int): Number of frames the ring holds.
+            channels (int): Number of channels per frame.
+            dtype: Sample type.
+        """
+        self.capacity = capacity
+        self.channels = channels
+        self.buffer = np.zeros((capacity, channels), dtype=dtype)
+        self.write_index = 0
+        self.read_index = 0
+        self.clear_index = 0  # Frames before this one are dropped unread, only the producer moves it
+
+    def available(self):
+        """Frames ready to be read."""
+        return self.write_index - self.read_index
+
+    def space(self):
+        """Frames that can be written without overwriting unread ones."""
+        return self.capacity - self.available()
+
+    def write(self, frames):
+        """
+        Producer side. Copies as many of `frames` as fit.
+
+        Returns:
+            int: Number of frames written.
+        """
+        count = min(len(frames), self.space())
+        start = self.write_index % self.capacity
+        first = min(count, self.capacity - start)
+        self.buffer[start:start + first] = frames[:first]
+        self.buffer[:count - first] = frames[first:count]
+        self.write_index += count
+        return count
+
+    def clear(self):
+        """
+        Producer side. Drops every frame written so far, the consumer skips
+        them on its next read. Frames written afterwards are kept.
+        """
+        self.clear_index = self.write_index
+
+    def read_into(self, out):
+        """
+        Consumer side. Fills `out` with as many frames as are available.
+
+        Returns:
+            int: Number of frames read, the rest of `out` is left untouched.
+        """
+        # Look at write_index before clear_index, frames written after a clear are never dropped
+        write_index = self.write_index
+        if self.read_index < self.clear_index:
+            self.read_index = self.clear_index
+        count = max(min(len(out), write_index - self.read_index), 0)
+        start = self.read_index % self.capacity
+        first = min(count, self.capacity - start)
+        out[:first] = self.buffer[start:start + first]
+        out[first:count] = self.buffer[:count - first]
+        self.read_index += count
+        return count
@@ -0,0 +1,89 @@
+import bisect
+import threading
+
+
+class SegmentStore:
+    def __init__(self, max_bytes=256 * 1024 ** 2):
+        """
+        Separated audio kept by its position in the song, so seeking back to
+        audio that was separated before replays it instead of separating it
+        again. Segments never overlap.
+
+        Args:
+            max_bytes (int): Upper bound on the size of all segments together, the
+                             segments farthest from the playback position go first.
+                             Unbounded if None.
+        """
+        self.max_bytes = max_bytes
+        self.starts = []  # Sorted start frames
+        self.segments = {}  # Start frame -> (stem names, int16 array of shape (stems, frames, channels))
+        self.bytes = 0
+        self.lock = threading.Lock()
+
+    def add(self, start, names, stacked, position=None):
+        """
+        Args:
+            start (int): Frame of the song the segment begins at.
+            names (list): Stem name of every entry along the first axis of `stacked`.
+            stacked (np.ndarray): Stems of shape (stems, frames, channels).
+            position (int): Current playback frame, decides what is evicted.
+        """
+        with self.lock:
+            bisect.insort(self.starts, start)
+            self.segments[start] = (names, stacked)
+            self.bytes += stacked.nbytes
+            self._evict(start if position is None else position)
+
+    def _end(self, start):
+        return start + self.segments[start][1].shape[1]
+
+    def _evict(self, position):
+        if self.max_bytes is None:
+            return
+
+        def distance(start):
+            if start > position:
+                return start - position
+            return max(position - self._end(start), 0)
+
+        while self.bytes > self.max_bytes and len(self.starts) > 1:
+            start = max(self.starts, key=distance)
+            self.starts.remove(start)
+            self.bytes -= self.segments.pop(start)[1].nbytes
+
+    def covered_until(self, position):
+        """End of the audio held without gaps from `position` on, `position` itself if there is none."""
+        with self.lock:
+            k = bisect.bisect_right(self.starts, position) - 1
+            end = position
+            if k < 0 or self._end(self.starts[k]) <= position:
+                return end
+            while k < len(self.starts) and self.starts[k] <= end:
+                end = max(end, self._end(self.starts[k]))
+                k += 1
+            return end
+
+    def next_start(self, position):
+        """Start of the first segment after `position`, None if there is none."""
+        with self.lock:
+            k = bisect.bisect_right(self.starts, position)
+            return self.starts[k] if k < len(self.starts) else None
+
+    def read(self, start, end):
+        """
+        Returns the held audio between frames `start` and `end`.
+
+        Returns:
+            list: (start frame, stem names, view of shape (stems, frames, channels)) per segment.
+        """
+        with self.lock:
+            parts = []
+            for segment_start in self.starts:
+                names, stacked = self.segments[segment_start]
+                segment_end = segment_start + stacked.shape[1]
+                if segment_end <= start or segment_start >= end:
+                    continue
+                a = max(start, segment_start)
+                b = min(end, segment_end)
+                parts.append((a, names, stacked[:, a - segment_start:b - segment_start]))
+            return parts
@@ -0,0 +1,117 @@
+import os
+import collections
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import torch
+from separator import Separator
+
+_separator = None  # The warm model held by each worker process
+
+
+def default_workers(threads_per_worker=4):
+    """Number of workers that keeps every worker at `threads_per_worker` torch threads."""
+    return max(1, (os.cpu_count() or 1) // threads_per_worker)
+
+
+def _init_worker(model, threads, separator_options):
+    global _separator
+    # Split the cores between workers instead of letting every worker grab all of them
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass  # Already fixed once torch ran an inter-op task in this process
+    _separator = Separator(model, device='cpu', **separator_options)
+
+
+def _model_info():
+    return _separator.samplerate, _separator.audio_channels, _separator.sources
+
+
+def _separate_window(window, config=None):
+    return _separator.separate_window(window, config)
+
+
+class SeparationPool:
+    def __init__(self, model='hdemucs_mmi', workers=None, max_pending=None, separator_options=None):
+        """
+        Separates chunks in parallel on a pool of worker processes, each of which
+        keeps its own warm copy of the model.
+
+        Args:
+            model (str): The Demucs model name every worker loads.
+            workers (int): Number of worker processes, see `default_workers`.
+            max_pending (int): How many chunks may be in flight ahead of the one
+                being delivered, defaults to twice the number of workers.
+            separator_options (dict): Further Separator arguments for every worker, e.g. from a CPU profile.
+        """
+        self.model_name = model
+        self.workers = workers or default_workers()
+        self.max_pending = max_pending or 2 * self.workers
+        self.threads_per_worker = max(1, (os.cpu_count() or 1) // self.workers)
+        self.config = None  # Separator.configure arguments sent along with every window
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(model, self.threads_per_worker, separator_options or {}),
+        )
+        # Blocks until a worker has loaded the model, so the first chunk doesn't pay for it
+        self.samplerate, self.audio_channels, self.sources = self.executor.submit(_model_info).result()
+        print(f"Started {self.workers} separation workers with {self.threads_per_worker} threads each.")
+
+    def separate_windows(self, windows, config=None, room=None, timings=None):
+        """
+        Dispatches windows to the workers ahead of consumption and yields the
+        results strictly in the order the windows were given. Closing the
+        generator early cancels the windows that haven't started yet.
+
+        Args:
+            windows (iterable): (index, window) pairs.
+            config (callable): Returns Separator.configure arguments for the next window, sent
+                along with it instead of changing the pool, which may be shared by several songs.
+            room (callable): Returns the seconds of audio that may still be separated ahead. The
+                windows in flight count against it, one window is always in flight.
+            timings (dict): Accepted like Separator.separate_windows but left empty, windows run in
+                parallel, so the time between deliveries already is the time per window.
+
+        Yields:
+            tuple: (index, stems)
+        """
+        pending = collections.deque()  # (index, future, seconds of audio)
+        windows = iter(windows)
+        exhausted = False
+        try:
+            while True:
+                while not exhausted and len(pending) < self.max_pending:
+                    in_flight = sum(seconds for _, _, seconds in pending)
+                    if pending and room is not None and in_flight >= room():
+                        break  # Playback has to catch up before more is separated
+                    try:
+                        i, window = next(windows)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    window_config = config() if config is not None else self.config
+                    future = self.executor.submit(_separate_window, window, window_config)
+                    pending.append((i, future, len(window) / self.samplerate))
+                if not pending:
+                    return
+                i, future, _ = pending.popleft()
+                yield i, future.result()
+        finally:
+            for i, future, _ in pending:
+                future.cancel()  # The consumer stopped early, e.g. after a seek
+
+    def configure(self, **config):
+        """Changes how windows submitted from now on are separated, see `Separator.configure`."""
+        self.config = dict(config)
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
@@ -0,0 +1,249 @@
+import time
+import queue
+import threading
+import numpy as np
+import torch
+from demucs.apply import apply_model
+from demucs.pretrained import get_model
+
+
+class Separator:
+    def __init__(self, model='hdemucs_mmi', device=None, shifts=1, overlap=0.25, split=True, segment=None,
+                 batch_size=1, max_wait=0.5, quantize=False, inference_mode=False):
+        """
+        Loads a Demucs model once and keeps it resident so chunks can be
+        separated one after another without reloading the weights.
+
+        Args:
+            model (str): The Demucs model name to load.
+            device (str): Torch device to run on, defaults to cuda when available.
+            shifts (int): Number of random shifts averaged by apply_model.
+            overlap (float): Overlap between the model's internal segments.
+            split (bool): Whether apply_model splits the input into segments.
+            segment (float): Override for the model's segment length in seconds.
+            batch_size (int): Most windows separate_windows stacks into one apply_model call.
+            max_wait (float): Seconds separate_windows waits for a batch to fill before running it.
+            quantize (bool): Whether to quantize the model's linear and LSTM layers to int8 on CPU.
+            inference_mode (bool): Whether to run the model under torch.inference_mode.
+        """
+        self.model_name = model
+        self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+        self.shifts = shifts
+        self.overlap = overlap
+        self.split = split
+        self.segment = segment
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.quantize = quantize
+        self.inference_mode = inference_mode
+        self.base_settings = (shifts, overlap, segment)  # What configure falls back to
+
+        self.models = {}  # Every model loaded so far by name, switching back to one is free
+        self.load_lock = threading.Lock()  # Callers sharing the separator may ask for a model at once
+        self.model = self._load(model)
+
+    def _load(self, model):
+        with self.load_lock:
+            return self._load_locked(model)
+
+    def _load_locked(self, model):
+        if model not in self.models:
+            loaded = get_model(model)
+            loaded.cpu()
+            loaded.eval()
+            if self.quantize and self.device == 'cpu':
+                loaded = torch.ao.quantization.quantize_dynamic(loaded, {torch.nn.Linear, torch.nn.LSTM},
+                                                                dtype=torch.qint8)
+            self.models[model] = loaded
+            print(f"Loaded Demucs model '{model}' on {self.device}{' (int8)' if self.quantize else ''}.")
+        return self.models[model]
+
+    def configure(self, model=None, shifts=None, overlap=None, segment=None):
+        """
+        Changes how the next chunks are separated, e.g. to trade quality for speed.
+        The model has to produce the same sources at the same sample rate.
+        Settings left at None go back to what the separator was created with.
+
+        Args:
+            model (str): Demucs model to switch to, the current one if None.
+            shifts (int): Number of random shifts averaged by apply_model.
+            overlap (float): Overlap between the model's internal segments.
+            segment (float): Override for the model's segment length in seconds.
+        """
+        if model is not None and model != self.model_name:
+            self.model = self._load(model)
+            self.model_name = model
+        base_shifts, base_overlap, base_segment = self.base_settings
+        self.shifts = base_shifts if shifts is None else shifts
+        self.overlap = base_overlap if overlap is None else overlap
+        self.segment = base_segment if segment is None else segment
+
+    def _settings(self, config):
+        """
+        (model, shifts, overlap, segment) for one call. `config` takes configure's
+        arguments but only applies to that call, the configured settings are used if None.
+        """
+        if config is None:
+            return self.model, self.shifts, self.overlap, self.segment
+        base_shifts, base_overlap, base_segment = self.base_settings
+        model = self._load(config['model']) if config.get('model') else self.model
+        shifts = base_shifts if config.get('shifts') is None else config['shifts']
+        overlap = base_overlap if config.get('overlap') is None else config['overlap']
+        segment = base_segment if config.get('segment') is None else config['segment']
+        return model, shifts, overlap, segment
+
+    @property
+    def samplerate(self):
+        return self.model.samplerate
+
+    @property
+    def audio_channels(self):
+        return self.model.audio_channels
+
+    @property
+    def sources(self):
+        return list(self.model.sources)
+
+    def separate(self, wav):
+        """
+        Separates a single chunk of audio.
+
+        Args:
+            wav (torch.Tensor): Float tensor of shape (channels, samples) at the model samplerate.
+
+        Returns:
+            torch.Tensor: Stems of shape (sources, channels, samples), ordered like `self.sources`.
+        """
+        return self.separate_batch([wav])[0]
+
+    def separate_batch(self, wavs, config=None):
+        """
+        Separates several chunks in one apply_model call by stacking them along
+        the batch dimension. Shorter chunks are zero padded to the longest one.
+
+        Args:
+            wavs (list): Float tensors of shape (channels, samples).
+            config (dict): configure arguments for this call only, see `_settings`.
+
+        Returns:
+            list: Stems of shape (sources, channels, samples) for every chunk.
+        """
+        length = max(wav.shape[-1] for wav in wavs)
+        mix = torch.zeros(len(wavs), wavs[0].shape[0], length)
+        stats = []
+        for k, wav in enumerate(wavs):
+            ref = wav.mean(0)
+            mean = ref.mean()
+            std = ref.std() + 1e-8  # silent chunks would otherwise divide by zero
+            mix[k, :, :wav.shape[-1]] = (wav - mean) / std
+            stats.append((mean, std))
+
+        model, shifts, overlap, segment = self._settings(config)
+        with torch.inference_mode() if self.inference_mode else torch.no_grad():
+            sources = apply_model(model, mix, device=self.device, shifts=shifts,
+                                  split=self.split, overlap=overlap, progress=False,
+                                  segment=segment)
+        return [sources[k, ..., :wav.shape[-1]] * std + mean
+                for k, (wav, (mean, std)) in enumerate(zip(wavs, stats))]
+
+    def _to_stems(self, sources):
+        return {name: np.ascontiguousarray(source.t().cpu().numpy(), dtype=np.float32)
+                for source, name in zip(sources, self.sources)}
+
+    def separate_window(self, window, config=None):
+        """
+        Separates one window of PCM from PCMStreamReader.
+
+        Args:
+            window (np.ndarray): float32 array of shape (samples, channels).
+            config (dict): configure arguments for this window only.
+
+        Returns:
+            dict: Stem name mapped to a float32 array of shape (samples, channels).
+        """
+        return self._to_stems(self.separate_batch([torch.from_numpy(window.T.copy())], config)[0])
+
+    def separate_windows(self, windows, config=None, room=None, timings=None):
+        """
+        Separates windows as they arrive. Once the first window is out, windows
+        are grouped into batches of up to `batch_size`, a batch runs early when
+        it has been filling for `max_wait` seconds. Windows are read on a helper
+        thread, so the deadline holds even while the stream stalls.
+
+        Args:
+            windows (iterable): (index, window) pairs.
+            config (callable): Returns configure arguments for the next batch. They only apply
+                to that batch, so a separator shared by several songs is never left reconfigured.
+            room (callable): Returns the seconds of audio that may still be separated ahead, a
+                batch runs early instead of collecting more than that.
+            timings (dict): Filled with the seconds each window index took to separate, the
+                time of a batch split evenly across its windows.
+
+        Yields:
+            tuple: (index, stems) in the order the windows were given.
+        """
+        if self.batch_size <= 1:
+            for i, window in windows:
+                yield from self._separate_batch_windows([(i, window)], config, timings)
+            return
+
+        arrivals = queue.Queue(maxsize=self.batch_size)
+        stop = threading.Event()
+        threading.Thread(target=self._feed, args=(windows, arrivals, stop), daemon=True).start()
+        batch = []
+        deadline = None
+        first = True
+        try:
+            while True:
+                try:
+                    kind, value = arrivals.get(timeout=max(deadline - time.time(), 0) if batch else None)
+                except queue.Empty:
+                    kind, value = 'due', None  # The batch has been filling for `max_wait`
+                if kind == 'end':
+                    break
+                if kind == 'error':
+                    raise value
+                if kind == 'window':
+                    if not batch:
+                        deadline = time.time() + self.max_wait
+                    batch.append(value)
+                full = room is not None and sum(len(w) for _, w in batch) / self.samplerate >= room()
+                # The first window is always separated alone so playback can start early
+                if first or full or len(batch) >= self.batch_size or time.time() >= deadline:
+                    yield from self._separate_batch_windows(batch, config, timings)
+                    batch = []
+                    first = False
+            if batch:
+                yield from self._separate_batch_windows(batch, config, timings)
+        finally:
+            stop.set()  # Lets the helper thread go if the consumer stopped early
+
+    @staticmethod
+    def _feed(windows, arrivals, stop):
+        """Hands windows over to separate_windows as ('window', (index, window)), then ('end', None)."""
+        def put(item):
+            while not stop.is_set():
+                try:
+                    arrivals.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        try:
+            for item in windows:
+                if not put(('window', item)):
+                    return
+            put(('end', None))
+        except Exception as e:
+            put(('error', e))
+
+    def _separate_batch_windows(self, batch, config=None, timings=None):
+        wavs = [torch.from_numpy(window.T.copy()) for i, window in batch]
+        start_time = time.time()
+        sources = self.separate_batch(wavs, config() if config is not None else None)
+        if timings is not None:
+            for i, window in batch:
+                timings[i] = (time.time() - start_time) / len(batch)
+        for (i, window), sources in zip(batch, sources):
+            yield i, self._to_stems(sources)
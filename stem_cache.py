@@ -0,0 +1,168 @@
+import os
+import json
+import time
+import hashlib
+import threading
+import numpy as np
+from audio_reader import PCMStreamReader
+
+
+class StemCache:
+    def __init__(self, root='cache/stems', max_bytes=2 * 1024 ** 3):
+        """
+        Persistent on-disk cache of separated stems, so a replayed song skips
+        separation entirely.
+
+        Entries are keyed by a hash of the decoded audio plus the model name and
+        chunking parameters. Every entry is one raw int16 file of shape
+        (samples, stems, channels) that is memory-mapped on a hit. The total
+        size is bounded by `max_bytes`, least recently used entries go first.
+
+        Args:
+            root (str): Directory the cache lives in.
+            max_bytes (int): Upper bound on the size of all entries together.
+        """
+        self.root = root
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        self.index_path = os.path.join(root, 'index.json')
+        try:
+            with open(self.index_path) as f:
+                self.index = json.load(f)
+        except (OSError, ValueError):
+            self.index = {'entries': {}, 'sources': {}}
+
+    def _save_index(self):
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.index, f)
+        os.replace(tmp_path, self.index_path)
+
+    def _entry_path(self, key):
+        return os.path.join(self.root, f"{key}.pcm")
+
+    def audio_hash(self, source, samplerate=44100, channels=2):
+        """
+        Hashes the decoded audio of `source`. The result is remembered per
+        path, size and modification time so an unchanged file is decoded once.
+        """
+        stat = os.stat(source)
+        source_id = f"{os.path.abspath(source)}|{stat.st_size}|{stat.st_mtime_ns}|{samplerate}|{channels}"
+        with self.lock:
+            if source_id in self.index['sources']:
+                return self.index['sources'][source_id]
+
+        digest = hashlib.sha1()
+        with PCMStreamReader(source, samplerate, channels) as reader:
+            while True:
+                block = reader.read(samplerate * 10)
+                if len(block) == 0:
+                    break
+                digest.update(block.tobytes())
+            reader.wait()
+
+        with self.lock:
+            self.index['sources'][source_id] = digest.hexdigest()
+            self._save_index()
+        return digest.hexdigest()
+
+    def key(self, source, model, params, samplerate=44100, channels=2, audio_id=None):
+        """
+        Returns the cache key for separating `source` with `model`.
+
+        Args:
+            source (str): Path to the source audio.
+            model (str): The Demucs model name.
+            params (dict): Chunking parameters that influence the stems.
+            audio_id (str): Stable identity of the audio, e.g. a video id, used instead of hashing
+                            the decoded audio. Needed for sources that aren't local files.
+        """
+        audio_hash = audio_id if audio_id is not None else self.audio_hash(source, samplerate, channels)
+        description = json.dumps({'audio': audio_hash, 'model': model, 'params': params}, sort_keys=True)
+        return hashlib.sha1(description.encode()).hexdigest()
+
+    def get(self, key):
+        """
+        Looks up an entry and marks it as recently used.
+
+        Returns:
+            tuple: (memory-mapped int16 array of shape (samples, stems, channels), entry metadata),
+                   or None on a miss.
+        """
+        with self.lock:
+            entry = self.index['entries'].get(key)
+            if entry is None or not os.path.exists(self._entry_path(key)):
+                return None
+            entry['last_used'] = time.time()
+            self._save_index()
+        shape = (entry['samples'], len(entry['sources']), entry['channels'])
+        stems = np.memmap(self._entry_path(key), dtype=np.int16, mode='r', shape=shape)
+        return stems, entry
+
+    def writer(self, key, sources, samplerate, channels):
+        return StemCacheWriter(self, key, sources, samplerate, channels)
+
+    def _add(self, key, entry):
+        with self.lock:
+            self.index['entries'][key] = entry
+            self._evict()
+            self._save_index()
+
+    def _evict(self):
+        entries = self.index['entries']
+        total = sum(entry['size'] for entry in entries.values())
+        for key in sorted(entries, key=lambda k: entries[k]['last_used']):
+            if total <= self.max_bytes:
+                break
+            total -= entries[key]['size']
+            del entries[key]
+            try:
+                os.remove(self._entry_path(key))
+            except OSError:
+                pass
+            print(f"Evicted cached stems {key}.")
+
+
+class StemCacheWriter:
+    def __init__(self, cache, key, sources, samplerate, channels):
+        """
+        Appends separated chunks to a new cache entry. The entry only becomes
+        visible once `commit` is called, a partial entry is never served.
+        """
+        self.cache = cache
+        self.key = key
+        self.sources = list(sources)
+        self.samplerate = samplerate
+        self.channels = channels
+        self.samples = 0
+        self.part_path = cache._entry_path(key) + '.part'
+        self.file = open(self.part_path, 'wb')
+
+    def append(self, stacked):
+        """
+        Args:
+            stacked (np.ndarray): int16 array of shape (stems, samples, channels), stems ordered like `sources`.
+        """
+        self.file.write(np.ascontiguousarray(stacked.transpose(1, 0, 2)).tobytes())
+        self.samples += stacked.shape[1]
+
+    def commit(self):
+        self.file.close()
+        os.replace(self.part_path, self.cache._entry_path(self.key))
+        self.cache._add(self.key, {
+            'sources': self.sources,
+            'samplerate': self.samplerate,
+            'channels': self.channels,
+            'samples': self.samples,
+            'size': os.path.getsize(self.cache._entry_path(self.key)),
+            'last_used': time.time(),
+        })
+        print(f"Cached stems {self.key} ({self.samples / self.samplerate:.1f} s).")
+
+    def abort(self):
+        self.file.close()
+        try:
+            os.remove(self.part_path)
+        except OSError:
+            pass
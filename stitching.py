@@ -0,0 +1,83 @@
+import numpy as np
+
+
+def fade_curves(length, shape='hann'):
+    """
+    Returns (fade_in, fade_out) gain curves of `length` samples.
+
+    'linear' and 'hann' fades sum to one, which keeps the level constant when
+    both chunks hold (nearly) the same audio, as separated overlaps do.
+    'equal_power' keeps the power constant for uncorrelated audio instead.
+    """
+    t = (np.arange(length, dtype=np.float32) + 0.5) / max(length, 1)
+    if shape == 'linear':
+        fade_in = t
+    elif shape == 'hann':
+        fade_in = np.sin(0.5 * np.pi * t) ** 2
+    elif shape == 'equal_power':
+        return np.sin(0.5 * np.pi * t), np.cos(0.5 * np.pi * t)
+    else:
+        raise ValueError(f"Unknown fade shape '{shape}'")
+    return fade_in, 1 - fade_in
+
+
+class OverlapAddStitcher:
+    def __init__(self, overlap_samples, fade='hann'):
+        """
+        Joins consecutive overlapping stem chunks into seamless audio by
+        crossfading the audio the two chunks share instead of cutting it away.
+
+        The tail of every chunk that the next chunk will overlap is held back
+        until that chunk arrives, so every call returns audio that can be
+        played right away.
+
+        Args:
+            overlap_samples (int): Padding every chunk got on each side.
+            fade (str): Fade shape, see `fade_curves`.
+        """
+        self.overlap = overlap_samples
+        self.fade = fade
+        self.held = None  # Tail of the previous chunk that the next one overlaps
+        self.held_after = 0  # How much of the held tail lies past the previous chunk's own audio
+
+    def push(self, stems, pads):
+        """
+        Args:
+            stems (dict): Stem name mapped to an array of shape (samples, channels).
+            pads (tuple): Samples of overlap before and after the chunk's own audio.
+
+        Returns:
+            dict: Stem name mapped to the next stretch of seamless audio.
+        """
+        front, back = pads
+        length = len(next(iter(stems.values())))
+        out = {}
+
+        if self.held is None:
+            start = front
+            for name, stem in stems.items():
+                out[name] = [stem[:0]]
+        else:
+            held_length = len(next(iter(self.held.values())))
+            aligned = min(self.held_after + front, length)  # Head of this chunk the held tail covers
+            fade_length = min(aligned, held_length)
+            fade_in, fade_out = fade_curves(fade_length, self.fade)
+            start = aligned
+            for name, stem in stems.items():
+                held = self.held[name]
+                crossfade = (held[held_length - fade_length:] * fade_out[:, None]
+                             + stem[aligned - fade_length:aligned] * fade_in[:, None])
+                out[name] = [held[:held_length - fade_length], crossfade.astype(stem.dtype)]
+
+        hold = min(back + self.overlap, length - start)
+        self.held = {name: stem[length - hold:] for name, stem in stems.items()}
+        self.held_after = back
+        return {name: np.concatenate(parts + [stems[name][start:length - hold]]) for name, parts in out.items()}
+
+    def flush(self):
+        """Returns the held tail of the last chunk once no more chunks follow."""
+        if self.held is None:
+            return None
+        out = {name: held[:len(held) - self.held_after] for name, held in self.held.items()}
+        self.held = None
+        return out
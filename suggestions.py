@@ -0,0 +1,221 @@
+import collections
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+def normalize_query(text):
+    """Cache key of a query: case, surrounding and repeated whitespace don't change the results."""
+    return " ".join(text.lower().split())
+
+
+def format_suggestions(items):
+    """Turns search results into (display text, video id) pairs."""
+    suggestions = []
+    for song in items:
+        song_name = song.get('name', None)
+        artist_name = song.get('artists', None)
+        if artist_name:
+            artist_name = artist_name[0].get('name', None)
+
+        if not artist_name:
+            s = f"{song_name}"
+        else:
+            s = f"{song_name} - {artist_name}"
+        suggestions.append((s, song.get('videoId', song.get('id', None))))
+    return suggestions
+
+
+class YouTubeMusicBackend:
+    def __init__(self, limit=5):
+        """
+        Searches YouTube Music.
+
+        Args:
+            limit (int): Most results kept per search.
+        """
+        import ytm
+        self.ytm = ytm
+        self.api = ytm.YouTubeMusic()
+        self.limit = limit
+
+    def _search(self, search, query):
+        try:
+            return search(query)['items'][:self.limit]
+        except Exception:
+            self.api = self.ytm.YouTubeMusic()  # The session may have gone stale, start a new one next time
+            raise
+
+    def search_videos(self, query):
+        return self._search(self.api.search_videos, query)
+
+    def search_songs(self, query):
+        return self._search(self.api.search_songs, query)
+
+
+class StubBackend:
+    def __init__(self, delay=0.2, limit=5):
+        """
+        Answers searches offline with made-up results after `delay` seconds, for
+        trying out and testing the suggestion service without a network.
+
+        Args:
+            delay (float): Seconds every search takes.
+            limit (int): Results per search.
+        """
+        self.delay = delay
+        self.limit = limit
+        self.calls = 0  # Searches answered, lets tests check what the cache saved
+
+    def _search(self, kind, query):
+        self.calls += 1
+        time.sleep(self.delay)
+        return [{'name': f"{query} {kind} {k}", 'artists': [{'name': "Stub Artist"}], 'videoId': f"{kind[0]}{k:010d}"}
+                for k in range(self.limit)]
+
+    def search_videos(self, query):
+        return self._search('video', query)
+
+    def search_songs(self, query):
+        return self._search('song', query)
+
+
+class SuggestionService:
+    def __init__(self, backend, cache_size=256, max_workers=4):
+        """
+        Looks up search suggestions on worker threads so the GUI never waits for
+        the network. The video and song searches of a query run concurrently,
+        results are kept in an LRU cache by normalized query, and a new query
+        cancels the ones still in flight.
+
+        Args:
+            backend: Has search_videos(query) and search_songs(query), see YouTubeMusicBackend and StubBackend.
+            cache_size (int): Most queries whose results are kept.
+            max_workers (int): Searches running at once.
+        """
+        self.backend = backend
+        self.cache_size = cache_size
+        self.cache = collections.OrderedDict()  # Normalized query -> suggestions, least recently used first
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="suggestions")
+        self.generation = 0  # Bumped by every request, results of older ones aren't delivered
+        self.in_flight = []  # Futures of the current request
+        self.lock = threading.Lock()
+
+    def cached(self, text):
+        """Cached suggestions for `text`, None on a miss."""
+        key = normalize_query(text)
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                return self.cache[key]
+        return None
+
+    def _store(self, key, suggestions):
+        with self.lock:
+            self.cache[key] = suggestions
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+    def request(self, text, callback):
+        """
+        Looks up suggestions for `text` and calls `callback(text, suggestions)`,
+        right away on a cache hit and otherwise from a worker thread once both
+        searches are done. Nothing is called back for a request that was
+        superseded by a newer one, or that failed.
+
+        Returns:
+            bool: Whether the suggestions came from the cache.
+        """
+        key = normalize_query(text)
+        with self.lock:
+            self.generation += 1
+            generation = self.generation
+            superseded, self.in_flight = self.in_flight, []
+        # Outside the lock, cancelling runs the done callbacks right away and they take it
+        for future in superseded:
+            future.cancel()  # Only stops searches that haven't started, the others finish and are cached
+        suggestions = self.cached(text)
+        if suggestions is not None:
+            callback(text, suggestions)
+            return True
+
+        videos = self.executor.submit(self.backend.search_videos, key)
+        songs = self.executor.submit(self.backend.search_songs, key)
+        pending = [videos, songs]
+        with self.lock:
+            if generation == self.generation:
+                self.in_flight = pending
+
+        remaining = [len(pending)]
+
+        def finished(_):
+            with self.lock:
+                remaining[0] -= 1
+                if remaining[0]:
+                    return  # The other search is still running
+            if any(future.cancelled() for future in pending):
+                return
+            try:
+                suggestions = format_suggestions(videos.result() + songs.result())
+            except Exception as e:
+                print(f"Error searching for songs: {e}")
+                return
+            self._store(key, suggestions)
+            with self.lock:
+                current = generation == self.generation
+            if current:
+                callback(text, suggestions)
+
+        for future in pending:
+            future.add_done_callback(finished)
+        return False
+
+    def close(self):
+        with self.lock:
+            self.generation += 1
+            superseded, self.in_flight = self.in_flight, []
+        for future in superseded:
+            future.cancel()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+if __name__ == "__main__":
+    # Offline check of the cache, superseding and concurrency against the stub backend
+    delay = 0.2
+    backend = StubBackend(delay=delay)
+    service = SuggestionService(backend)
+    delivered = []
+    done = threading.Event()
+
+    def show(text, suggestions):
+        print(f"{text!r}: {len(suggestions)} suggestions, first {suggestions[0][0]!r}")
+        delivered.append(text)
+        done.set()
+
+    # Both searches of a query run at once, so a miss takes about one delay
+    started = time.monotonic()
+    assert not service.request("daft", show)
+    assert done.wait(5 * delay)
+    elapsed = time.monotonic() - started
+    assert elapsed < 1.5 * delay, f"searches ran one after the other, {elapsed:.2f} s"
+    assert backend.calls == 2
+
+    # The same query typed differently is a cache hit, answered right away without the backend
+    done.clear()
+    assert service.request("Daft  ", show)
+    assert done.is_set() and backend.calls == 2
+
+    # Only the latest of queries typed in quick succession is called back
+    done.clear()
+    delivered.clear()
+    service.request("daft p", show)
+    time.sleep(delay / 2)  # Its searches are running by now, they finish but mustn't call back
+    service.request("daft pu", show)
+    assert done.wait(5 * delay)
+    time.sleep(2 * delay)  # Long enough for the searches of "daft p" to have finished too
+    assert delivered == ["daft pu"], delivered
+    assert backend.calls == 6 and service.cached("daft p") is not None
+
+    print(f"{backend.calls} searches reached the backend, all checks passed")
+    service.close()
@@ -0,0 +1,95 @@
+import os
+import hashlib
+import collections
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from PyQt6.QtCore import QObject, QSize, Qt, pyqtSignal
+from PyQt6.QtGui import QImage, QPixmap
+
+
+def thumbnail_url(video_id):
+    """Smallest thumbnail YouTube serves for a video, enough for a suggestion row."""
+    return f"https://i.ytimg.com/vi/{video_id}/default.jpg"
+
+
+class ThumbnailService(QObject):
+    # Emitted in the GUI thread once the thumbnail of the url is in the cache
+    ready = pyqtSignal(str)
+    # (url, scaled image), emitted from a worker thread, QPixmaps may only be made in the GUI thread
+    _loaded = pyqtSignal(str, QImage)
+
+    def __init__(self, size=QSize(40, 40), max_bytes=16 * 1024 ** 2, disk_dir=None, max_workers=4, parent=None):
+        """
+        Fetches and decodes thumbnails on worker threads, scales them once and
+        keeps them as ready QPixmaps in an LRU cache bounded by memory, so
+        painting only ever reads from memory.
+
+        Args:
+            size (QSize): Size the thumbnails are scaled to, keeping their aspect ratio.
+            max_bytes (int): Upper bound on the pixel data of all cached pixmaps.
+            disk_dir (str): Directory scaled thumbnails are also kept in across runs, none if None.
+            max_workers (int): Thumbnails fetched at once.
+            parent (QObject): Qt parent.
+        """
+        super().__init__(parent)
+        self.size = size
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        if disk_dir is not None:
+            os.makedirs(disk_dir, exist_ok=True)
+        self.pixmaps = collections.OrderedDict()  # url -> (QPixmap, bytes of pixel data), least recently used first
+        self.bytes = 0
+        self.pending = set()  # Urls being fetched, only touched in the GUI thread
+        self.failed = set()  # Urls that couldn't be fetched, not tried again
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="thumbnails")
+        self._loaded.connect(self._store)
+
+    def pixmap(self, url):
+        """
+        GUI side. The cached thumbnail of `url`, None until it has arrived. A
+        miss starts fetching it in the background, `ready` is emitted once it is in.
+        """
+        if url in self.pixmaps:
+            self.pixmaps.move_to_end(url)
+            return self.pixmaps[url][0]
+        if url not in self.pending and url not in self.failed:
+            self.pending.add(url)
+            self.executor.submit(self._fetch, url)
+        return None
+
+    def _disk_path(self, url):
+        return os.path.join(self.disk_dir, hashlib.sha1(url.encode()).hexdigest() + ".png")
+
+    def _fetch(self, url):
+        image = QImage()
+        try:
+            if self.disk_dir is not None and image.load(self._disk_path(url)):
+                self._loaded.emit(url, image)  # Stored already scaled
+                return
+            with urllib.request.urlopen(url, timeout=10) as response:
+                data = response.read()
+            if not image.loadFromData(data):
+                raise ValueError("not an image")
+            image = image.scaled(self.size, Qt.AspectRatioMode.KeepAspectRatio,
+                                 Qt.TransformationMode.SmoothTransformation)
+            if self.disk_dir is not None:
+                image.save(self._disk_path(url), "PNG")
+        except Exception as e:
+            print(f"Error loading thumbnail '{url}': {e}")
+            image = QImage()
+        self._loaded.emit(url, image)
+
+    def _store(self, url, image):
+        self.pending.discard(url)
+        if image.isNull():
+            self.failed.add(url)
+            return
+        self.pixmaps[url] = (QPixmap.fromImage(image), image.sizeInBytes())
+        self.bytes += image.sizeInBytes()
+        while self.bytes > self.max_bytes and len(self.pixmaps) > 1:
+            _, (_, nbytes) = self.pixmaps.popitem(last=False)
+            self.bytes -= nbytes
+        self.ready.emit(url)
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,144 @@
+import os
+import json
+import time
+import argparse
+import statistics
+import torch
+from separator import Separator
+
+profile_path = 'cache/cpu_profile.json'  # Tuned settings per model, written by `python tuning.py`
+
+# Separator arguments a profile may set, the rest of a profile entry is what the tuner measured
+separator_settings = ('inference_mode', 'quantize', 'overlap', 'segment')
+
+
+def load_profile(model, path=profile_path):
+    """
+    Returns the settings tuned for `model` on this machine, None if it was never tuned
+    or was tuned on a machine with a different number of cores.
+    """
+    try:
+        with open(path) as f:
+            profile = json.load(f).get(model)
+    except (OSError, ValueError):
+        return None
+    if profile is None or profile.get('cpu_count') != os.cpu_count():
+        return None
+    return profile
+
+
+def apply_profile(model, path=profile_path):
+    """
+    Sets the torch thread count tuned for `model` and returns the matching Separator
+    arguments, an empty dict if there is no usable profile.
+
+    Returns:
+        dict: Keyword arguments for Separator or SeparationPool.
+    """
+    profile = load_profile(model, path)
+    if profile is None:
+        return {}
+    torch.set_num_threads(profile['threads'])
+    print(f"Loaded CPU profile for '{model}': {profile['threads']} threads, "
+          + ", ".join(f"{name} {profile[name]}" for name in separator_settings) + ".")
+    return {name: profile[name] for name in separator_settings}
+
+
+def save_profile(model, settings, path=profile_path):
+    try:
+        with open(path) as f:
+            profiles = json.load(f)
+    except (OSError, ValueError):
+        profiles = {}
+    profiles[model] = settings
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(profiles, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def tune(model='hdemucs_mmi', seconds=20.0, min_sdr=20.0, repeats=2, path=profile_path):
+    """
+    Finds the fastest way to separate with `model` on this CPU whose output stays
+    within `min_sdr` dB of the plain fp32 output, and saves it as the model's profile.
+
+    Knobs are tuned one after another, each at the best values found so far for
+    the ones before it: torch threads, inference mode, int8 quantization, the
+    overlap and the segment length of apply_model. Runs use no random shifts,
+    otherwise two runs of the same settings wouldn't be comparable.
+
+    Args:
+        model (str): The Demucs model name.
+        seconds (float): Length of the synthetic test signal.
+        min_sdr (float): Lowest SDR against the reference output a setting may have.
+        repeats (int): Runs per setting, the fastest one counts.
+        path (str): Profile file to update.
+
+    Returns:
+        dict: The saved profile entry.
+    """
+    # The player loads profiles through this module, only tuning needs the benchmark helpers
+    from benchmark import synthetic_audio, sdr, timed
+
+    audio = synthetic_audio(seconds)
+    separators = {False: Separator(model, device='cpu', shifts=0)}
+    separators[True] = Separator(model, device='cpu', shifts=0, quantize=True)
+
+    cpu_count = os.cpu_count() or 1
+    best = {'threads': cpu_count, 'inference_mode': False, 'quantize': False, 'overlap': 0.25, 'segment': None}
+    torch.set_num_threads(cpu_count)
+    reference = separators[False].separate_window(audio)
+
+    def measure(settings):
+        torch.set_num_threads(settings['threads'])
+        separator = separators[settings['quantize']]
+        separator.inference_mode = settings['inference_mode']
+        separator.configure(overlap=settings['overlap'], segment=settings['segment'])
+        stems = {}
+
+        def run():
+            stems.update(separator.separate_window(audio))
+
+        elapsed = min(timed(run) for _ in range(repeats))
+        quality = statistics.mean(sdr(reference[name], stems[name]) for name in separator.sources)
+        return elapsed / seconds, quality
+
+    candidates = {
+        'threads': sorted({1 << k for k in range(cpu_count.bit_length())} | {cpu_count}),
+        'inference_mode': [False, True],
+        'quantize': [False, True],
+        'overlap': [0.25, 0.1, 0.0],
+        'segment': [None, 6.0, 4.0],
+    }
+    best_rtf, best_sdr = None, None
+    print(f"\nTuning '{model}' on {cpu_count} cores with {seconds:.0f} s of audio, SDR of at least {min_sdr:.1f} dB")
+    for knob, values in candidates.items():
+        for value in values:
+            settings = dict(best, **{knob: value})
+            try:
+                rtf, quality = measure(settings)
+            except Exception as e:
+                print(f"{knob:>14} {str(value):>5}: failed ({e})")
+                continue
+            print(f"{knob:>14} {str(value):>5}: RTF {rtf:.3f} | SDR {quality:6.2f} dB")
+            if quality < min_sdr:
+                continue
+            if best_rtf is None or rtf < best_rtf:
+                best, best_rtf, best_sdr = settings, rtf, quality
+
+    profile = dict(best, rtf=best_rtf, sdr=best_sdr, cpu_count=cpu_count, tuned_at=time.time())
+    save_profile(model, profile, path)
+    print(f"Saved profile to {path}: " + ", ".join(f"{name} {best[name]}" for name in best)
+          + f" (RTF {best_rtf:.3f}, SDR {best_sdr:.2f} dB).")
+    return profile
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tune CPU separation settings for this machine")
+    parser.add_argument("--model", default="hdemucs_mmi")
+    parser.add_argument("--seconds", type=float, default=20.0, help="length of the synthetic test signal")
+    parser.add_argument("--min-sdr", type=float, default=20.0, help="lowest SDR in dB against the fp32 output")
+    parser.add_argument("--repeats", type=int, default=2)
+    args = parser.parse_args()
+    tune(args.model, args.seconds, args.min_sdr, args.repeats)
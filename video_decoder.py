@@ -0,0 +1,147 @@
+import collections
+import threading
+import time
+import cv2
+from PyQt6.QtGui import QImage
+
+
+class VideoDecoder:
+    def __init__(self, source, clock, ring_size=4):
+        """
+        Decodes video on a worker thread, paced by the audio clock, into a small
+        ring of ready QImages. The GUI thread only picks the frame that is due
+        and blits it.
+
+        Frames that would be late are skipped with grab(), which demuxes without
+        decoding, and a jump of more than a second is a seek instead. Decoded
+        frames are wrapped as BGR QImages without converting or copying them.
+
+        Args:
+            source (str): Path or URL of the video.
+            clock (callable): Returns the playback position in milliseconds, called from the worker.
+            ring_size (int): Most decoded frames waiting to be shown.
+        """
+        self.source = source
+        self.clock = clock
+        self.ring_size = ring_size
+        self.fps = None  # Known once the worker opened the source
+        self.ring = collections.deque()  # (frame number, QImage, the frame the image points into)
+        self.next_frame = 0  # Frame the worker decodes or skips next
+        self.seek_ms = None  # Position the worker jumps to before decoding on
+        self.generation = 0  # Bumped by every seek, frames decoded for an older one are dropped
+        self.finished = False  # Set once decoding reached the end of the video
+        self.current = None  # Frame on screen, the QImage points into it
+        self.shown = 0  # Frames handed to the GUI
+        self.skipped = 0  # Frames the worker skipped over without decoding, only the worker moves it
+        self.superseded = 0  # Frames decoded but passed over by a later one, only the GUI moves it
+        self.late = 0  # Frames shown more than one frame period after they were due
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        """
+        Tells the worker to stop without waiting for it, it may be blocked opening or
+        reading a network stream for seconds. It releases the capture once it notices.
+        """
+        self.stop_event.set()
+        print(f"Video: {self.shown} frames shown, {self.dropped} dropped, {self.late} late.")
+
+    @property
+    def dropped(self):
+        """Frames that were never shown."""
+        return self.skipped + self.superseded
+
+    def _due_frame(self):
+        return int(self.clock() * self.fps / 1000)
+
+    def _run(self):
+        capture = cv2.VideoCapture(self.source)
+        try:
+            self.fps = capture.get(cv2.CAP_PROP_FPS) or 30.0
+            while not self.stop_event.is_set():
+                with self.lock:
+                    generation = self.generation
+                    seek_ms, self.seek_ms = self.seek_ms, None
+                    full = len(self.ring) >= self.ring_size
+                if seek_ms is not None:
+                    self.next_frame = int(seek_ms * self.fps / 1000)
+                    capture.set(cv2.CAP_PROP_POS_FRAMES, self.next_frame)
+                    self.finished = False
+                if full or self.finished:
+                    time.sleep(0.005)
+                    continue
+
+                due = self._due_frame()
+                if self.next_frame < due - self.fps:
+                    # More than a second behind, seeking is cheaper than skipping
+                    capture.set(cv2.CAP_PROP_POS_FRAMES, due)
+                    self.skipped += due - self.next_frame
+                    self.next_frame = due
+                    continue
+                if self.next_frame < due:
+                    # Would be late, skip it without decoding
+                    if not capture.grab():
+                        self.finished = True
+                        continue
+                    self.skipped += 1
+                    self.next_frame += 1
+                    continue
+
+                ok, frame = capture.read()
+                if not ok:
+                    self.finished = True
+                    continue
+                h, w, ch = frame.shape
+                image = QImage(frame.data, w, h, ch * w, QImage.Format.Format_BGR888)
+                with self.lock:
+                    if generation == self.generation:
+                        self.ring.append((self.next_frame, image, frame))
+                self.next_frame += 1
+        except Exception as e:
+            print(f"Error decoding video: {e}")
+            self.finished = True
+        finally:
+            capture.release()
+
+    def seek(self, position_ms):
+        """Drops the decoded frames and continues decoding at `position_ms`."""
+        with self.lock:
+            self.ring.clear()
+            self.generation += 1
+            self.seek_ms = position_ms
+
+    def take(self):
+        """
+        GUI side. Returns the latest decoded frame that is due by the audio clock,
+        None if none is due yet. Due frames it passes over count as dropped.
+
+        Returns:
+            QImage: The frame to show, valid until the next call.
+        """
+        if self.fps is None:
+            return None
+        due = self._due_frame()
+        shown = None
+        with self.lock:
+            while self.ring and self.ring[0][0] <= due:
+                if shown is not None:
+                    self.superseded += 1
+                shown = self.ring.popleft()
+        if shown is None:
+            return None
+        self.shown += 1
+        if due - shown[0] > 1:
+            self.late += 1
+        self.current = shown  # Keeps the frame the image points into alive while it is on screen
+        return shown[1]
+
+    @property
+    def done(self):
+        """Whether every frame of the video has been handed out."""
+        with self.lock:
+            return self.finished and not self.ring
@@ -1,41 +1,95 @@
+import re
+import copy
+import time
+import threading
 import yt_dlp
 
-def download_video_and_audio(url, username='oauth2', password='', output_dir='.'):
+# Video capped at 480p next to the best audio, preferring the containers ffmpeg decodes without a transcode
+stream_format = ('bestvideo[height<=480]+bestaudio[acodec=opus]/bestvideo[height<=480]+bestaudio[ext=m4a]/'
+                 'bestvideo[height<=480]+bestaudio/best[height<=480]')
+cache_ttl = 60 * 60  # Seconds resolved streams are reused, YouTube stream URLs stay valid for a few hours
+
+_streams = {}  # Video id -> (time resolved, (video URL, audio URL, audio format, info dict))
+_streams_lock = threading.Lock()
+
+
+def video_id(url):
+    """The 11 character id of a YouTube link, the link itself if it has none."""
+    match = re.search(r'(?:v=|youtu\.be/|embed/|v/)([A-Za-z0-9_-]{11})', url)
+    return match.group(1) if match else url
+
+
+def _extract(url, username='oauth2', password=''):
+    """Resolves a link once, or reuses what it resolved to within `cache_ttl`."""
+    key = video_id(url)
+    with _streams_lock:
+        cached = _streams.get(key)
+        if cached is not None and time.monotonic() - cached[0] < cache_ttl:
+            return cached[1]
+
     ydl_opts = {
-        'format': 'bestvideo[height<=480]',  # Choose the best video with a maximum height of 480p
+        'username': username,
+        'password': password,
+        'format': stream_format,
+        'quiet': True,
+        'noplaylist': True,
     }
+    # One extraction gives the info and both streams
     with yt_dlp.YoutubeDL(ydl_opts) as ydl:
         info_dict = ydl.extract_info(url, download=False)
-        video_url = info_dict.get('url')
-    # Options for downloading the best audio available and converting it to MP3
+    formats = info_dict.get('requested_formats')
+    if formats:
+        video_format, audio_format = formats[0], formats[-1]
+    else:
+        video_format = audio_format = info_dict  # A single format carrying both
+    result = (video_format.get('url'), audio_format.get('url'), audio_format, info_dict)
+
+    with _streams_lock:
+        _streams[key] = (time.monotonic(), result)
+        _streams[info_dict.get('id', key)] = (time.monotonic(), result)
+    return result
+
+
+def resolve_streams(url, username='oauth2', password=''):
+    """
+    Resolves direct stream URLs without downloading anything, so playback and
+    separation can read the audio while it arrives. The audio stays in its
+    native container (opus or m4a) and is decoded by ffmpeg directly.
+
+    Returns:
+        tuple: (video stream URL, audio stream URL, HTTP headers the audio URL expects, info dict)
+    """
+    video_url, audio_url, audio_format, info_dict = _extract(url, username, password)
+    return video_url, audio_url, audio_format.get('http_headers') or {}, info_dict
+
+
+def download_video_and_audio(url, username='oauth2', password='', output_dir='.'):
+    """
+    Resolves the video stream and downloads the audio stream as it is served,
+    without converting it. The download reuses the extraction and goes through
+    yt-dlp's own downloader, which handles chunking, retries and protocols.
+
+    Returns:
+        tuple: (video stream URL, path of the downloaded audio, info dict)
+    """
+    video_url, audio_url, audio_format, info_dict = _extract(url, username, password)
     audio_opts = {
         'username': username,
         'password': password,
-        'format': 'bestaudio',  # Download best audio available
-        'postprocessors': [{
-            'key': 'FFmpegExtractAudio',  # Use FFmpeg to extract audio
-            'preferredcodec': 'mp3',  # Convert audio to MP3
-            'preferredquality': '192',  # Set quality (you can adjust this as needed)
-        }],
-        'outtmpl': f'{output_dir}/%(id)s.%(ext)s',  # Output template for audio
+        'format': audio_format.get('format_id', 'bestaudio'),  # Only the audio stream, no postprocessor
+        'outtmpl': f'{output_dir}/%(id)s.%(ext)s',
+        'quiet': True,
     }
-
-    # Initialize yt_dlp and get video info to construct file paths
-    with yt_dlp.YoutubeDL() as ydl:
-        info_dict = ydl.extract_info(url, download=False)
-        video_id = info_dict.get('id', 'downloaded_video')
-
-    
-    audio_path = f"{output_dir}/{video_id}.mp3"
-
-    # Download and convert the audio
     with yt_dlp.YoutubeDL(audio_opts) as ydl:
-        ydl.download([url])
-
+        # A copy, processing the info fills it in and the cached one has to stay as extracted
+        result = ydl.process_ie_result(copy.deepcopy(info_dict), download=True)
+    downloads = result.get('requested_downloads') or [{}]
+    audio_path = downloads[0].get('filepath') or \
+        f"{output_dir}/{info_dict.get('id', 'downloaded_video')}.{audio_format.get('ext', 'webm')}"
     return video_url, audio_path, info_dict
 
 # Example usage:
 if __name__ == "__main__":
-    video_file, audio_file = download_video_and_audio('https://www.youtube.com/watch?v=2ZBtPf7FOoM')
-    print("Video file:", video_file)
+    video_url, audio_file, info_dict = download_video_and_audio('https://www.youtube.com/watch?v=2ZBtPf7FOoM')
+    print("Video URL:", video_url)
     print("Audio file:", audio_file)